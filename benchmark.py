@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import json
+import sys
+import timeit
+import tracemalloc
+import solmate_codec as sol_codec
+import solmate_ha_config as sol_ha_config
+import solmate_utils as sol_utils
+
+# micro benchmarks for hot code paths, run with: python benchmark.py
+# the results are printed only, nothing is changed.
+# the frames below are SYNTHETIC: made up responses of one poll cycle with the fields esham uses,
+# they are not captured from a SolMate. the results show the relative cost of the codec, not real traffic.
+# replace them with your own, printed with 'general_print_response=True', to measure your SolMate
+
+frames = {
+	'live_values': '{"id": 12, "data": {"timestamp": "2025-06-01T12:31:08", "pv_power": 412.36, "inject_power": 250.01, "battery_flow": 162.35, "battery_state": 0.6431, "temperature": 38.51, "mppOutI": 8.24}}',
+	'get_injection_settings': '{"id": 13, "data": {"user_minimum_injection": 50, "user_maximum_injection": 250, "user_minimum_battery_percentage": 10}}',
+	'get_boost_injection': '{"id": 14, "data": {"set_time": 0, "set_wattage": 300, "remaining_time": 0, "actual_wattage": 0}}',
+}
+
+requests = [{'id': 12 + i, 'route': route, 'data': {}} for i, route in enumerate(frames)]
+
+def cycle_stdlib():
+	# what a poll cycle did before: encode requests, decode responses, encode mqtt payloads
+	for request in requests:
+		json.dumps(request)
+	for frame in frames.values():
+		json.dumps(json.loads(frame)['data'])
+
+def cycle_codec():
+	# the same using the codec
+	for request in requests:
+		sol_codec.dumps_text(request)
+	for frame in frames.values():
+		sol_codec.dumps(sol_codec.loads(frame)['data'])
+
+def run(name, func, number):
+	# return the time for one call in microseconds
+	best = min(timeit.repeat(func, number = number, repeat = 5))
+	usec = best / number * 1e6
+	print(name.ljust(40) + format(usec, '8.2f') + ' us')
+	return usec
+
+def bench_codec(number):
+	print('\njson codec per poll cycle, synthetic frames (backend: ' + sol_codec.backend + ')')
+	stdlib = run('stdlib json', cycle_stdlib, number)
+	codec = run('solmate_codec', cycle_codec, number)
+	print('saving per cycle'.ljust(40) + format(stdlib - codec, '8.2f') + ' us (' + format((1 - codec / stdlib) * 100, '.0f') + '%)')
+
+class ha_setup:
+	# the attributes of solmate_mqtt the HA entity registry is compiled from
+	mqtt_sensor_topic = 'eet/sensor/solmate'
+	mqtt_number_topic = 'eet/number/solmate'
+	mqtt_button_topic = 'eet/button/solmate'
+	mqtt_sensor_config_topic = 'homeassistant/sensor/solmate'
+	mqtt_number_config_topic = 'homeassistant/number/solmate'
+	mqtt_button_config_topic = 'homeassistant/button/solmate'
+	mqtt_availability_topic = 'eet/sensor/solmate/availability'
+	mqtt_never_available_topic = 'eet/sensor/solmate/never_available'
+	mqtt_bridge_topic = None
+	mqtt_ha = 'homeassistant'
+	mqtt_topic = 'solmate'
+	mqtt_qos_command = 2
+	api_available = {'hasUserSettings': True, 'sun2plugHasBoostInjection': True, 'local': True, 'shutdown': True}
+
+def compile_lookup():
+	# what dispatching commands needs: the registry without serialized configs
+	sol_ha_config.compile_registry(ha_setup).by_command
+
+def compile_publish():
+	# what publishing the configs needs: the registry with all configs serialized
+	for e in sol_ha_config.compile_registry(ha_setup).entities:
+		e.payload
+
+def compile_device():
+	# what publishing the device config needs with 'general_ha_device_discovery'
+	sol_ha_config.compile_registry(ha_setup).device_payload
+
+def bench_registry(number):
+	print('\nHA entity registry (' + str(len(sol_ha_config.entities)) + ' entities)')
+	run('compile for lookups', compile_lookup, number)
+	run('compile and serialize all configs', compile_publish, number)
+	run('compile and serialize the device config', compile_device, number)
+
+	# the memory allocated by a registry with all configs serialized
+	tracemalloc.start()
+	registry = sol_ha_config.compile_registry(ha_setup)
+	for e in registry.entities:
+		e.payload
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	print('memory of a registry'.ljust(40) + format(size / 1024, '8.1f') + ' KiB (peak ' + format(peak / 1024, '.1f') + ' KiB)')
+
+if __name__ == '__main__':
+	number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	bench_codec(number)
+
+	# the HA config needs a config to resolve its values from, like the defaults of solmate_env.py
+	sol_utils.set_config({
+		'mqtt_topic': 'solmate',
+		'eet_serial_number': 'S1234567890',
+		'eet_spare_serial_number': False,
+		'internal_esham_version': 'benchmark',
+		'default_boost_injection_wattage': 500,
+		'default_max_boost_time': 10800,
+		'default_min_boost_time': 0,
+		'default_user_maximum_injection': 800,
+		'default_user_minimum_injection': 0,
+		'default_max_battery': 90,
+		'default_user_minimum_battery_percentage': 0
+	})
+	bench_registry(max(1, number // 20))
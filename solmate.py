@@ -1,12 +1,19 @@
 #!/usr/bin/env python
+import asyncio
 import os
 import sys
+import solmate_fleet as sol_fleet
 import solmate_main as sol_main
 import solmate_utils as sol_utils
 
 if __name__ == '__main__':
 	try:
-		sol_main.main()
+		# everything runs as coroutines on one long-lived event loop
+		if len(sys.argv) > 2:
+			# multiple env files as arguments, handle all solmates in this process
+			asyncio.run(sol_fleet.main(sys.argv[1:]))
+		else:
+			asyncio.run(sol_main.main())
 	except KeyboardInterrupt:
 		# avoid printing ^C on the console
 		# \r = carriage return (octal 015)
@@ -1,3 +1,4 @@
+import asyncio
 import solmate_main as sol_main
 import solmate_utils as sol_utils
 
@@ -7,7 +8,8 @@ import solmate_utils as sol_utils
 def main(self, env_name_appendix, sn):
 	try:
 		self.env_name_appendix = env_name_appendix
-		sol_main.main(self)
+		# everything runs as coroutines on one long-lived event loop
+		asyncio.run(sol_main.main(self))
 
 	except SystemExit as err:
 		# catch system exit raised by 'sys.exit()'
@@ -0,0 +1,33 @@
+import json
+
+# json encoding and decoding used for websocket frames and mqtt payloads
+# if 'orjson' is installed it is used as it is much faster, else we fall back to the stdlib.
+# encoding returns bytes which can be handed over to mqtt without any conversion.
+# note that orjson always writes utf-8 and does not escape non ascii characters,
+# the result is valid json either way.
+
+try:
+	import orjson
+	backend = 'orjson'
+except ImportError:
+	orjson = None
+	backend = 'json'
+
+def dumps(obj):
+	# encode an object into json bytes
+	if orjson:
+		return orjson.dumps(obj)
+	return json.dumps(obj, separators=(',', ':')).encode()
+
+def dumps_text(obj):
+	# encode an object into a json string
+	# websocket text frames need a string, sending bytes would create a binary frame
+	if orjson:
+		return orjson.dumps(obj).decode()
+	return json.dumps(obj, separators=(',', ':'))
+
+def loads(data):
+	# decode json bytes or a json string into an object
+	if orjson:
+		return orjson.loads(data)
+	return json.loads(data)
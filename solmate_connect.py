@@ -1,3 +1,4 @@
+import json
 import sys
 import signal
 import solmate_utils as sol_utils
@@ -6,15 +7,18 @@ import solmate_websocket as sol_smws
 # code that connects to the respective classes and returns the connection object
 # return solmate connection dependent api routes
 
-def connect_solmate():
+async def connect_solmate(server_uri = None):
 	# connect to the solmate via websocket
+	# the server uri defaults to the configured one, in dual path mode it can be the standby one
+	server_uri = server_uri or sol_utils.merged_config['eet_server_uri']
 
 	try:
 		# Initialize websocket
-		# when en error occurs during connenction, we wait 'timer_offline', part of the exception
-		smws_conn = sol_smws.connect_to_solmate()
+		# when en error occurs during connenction, the failure class 'offline' is part of the exception
+		smws_conn = sol_smws.connect_to_solmate(server_uri)
+		await smws_conn.connect()
 		# when en error occurs during authentication we hard stop - the pwd is wrong
-		response = smws_conn.authenticate()
+		response = await smws_conn.authenticate()
 
 	except Exception as err:
 		# here, most likely redirection or hash errors occur when connecting to the cloud
@@ -29,7 +33,7 @@ def connect_solmate():
 	if 'eet_local_subdomain' in sol_utils.merged_config:
 		# only if the key is configured
 		# value_if_true if condition else value_if_false
-		local = True if sol_utils.merged_config['eet_local_subdomain'] in sol_utils.merged_config['eet_server_uri'] else False
+		local = True if sol_utils.merged_config['eet_local_subdomain'] in server_uri else False
 	else:
 		local = False
 
@@ -58,7 +62,7 @@ def connect_solmate():
 
 	return smws_conn, online, local
 
-def connect_mqtt(api_available):
+async def connect_mqtt(api_available):
 	# connect to the mqtt broker
 
 	# IMPORTANT: import the module here because we need to have 'solmate_env' executed first !
@@ -69,7 +73,7 @@ def connect_mqtt(api_available):
 		# initialize and start mqtt
 		try:
 			mqtt_conn = sol_mmqtt.solmate_mqtt(api_available)
-			mqtt_conn.init_mqtt_client()
+			await mqtt_conn.init_mqtt_client()
 			# note that signal handling must be done after initializing mqtt
 			# else the handler cant gracefully shutdown mqtt.
 			# use os.kill(os.getpid(), signal.SIGTERM) where necessary to simulate e.g. a sigterm
@@ -96,24 +100,85 @@ def connect_mqtt(api_available):
 
 	return mqtt_conn
 
-def check_routes(smws_conn, local):
+# the capabilities that depend on the firmware and the connection type and the route that provides it
+# the name is if seen 1:1 from the webUI, true | false
+# some routes ares only available when connected locally but (currently) not via the cloud
+capability_routes = {
+	'sun2plugHasBoostInjection': 'get_boost_injection',
+	'hasUserSettings': 'get_injection_settings'
+}
+
+def _api_routes(response):
+	# return the routes listed in the 'get_api_info' response.
+	# the response is not documented, only the layouts listing routes are taken: a dictionary with
+	# the routes as keys or a list of routes, both either directly or below 'routes'. in a list,
+	# a route is a name or a dictionary with the name in 'route' or 'name'.
+	# descriptions or values that happen to equal a route name are not taken.
+	# returns an empty set if the layout is not known, the routes are then checked with a request each
+	if isinstance(response, dict) and 'routes' in response:
+		response = response['routes']
+	if isinstance(response, dict):
+		return set(str(key) for key in response)
+	if not isinstance(response, list):
+		return set()
+	names = set()
+	for item in response:
+		if isinstance(item, dict):
+			item = item.get('route', item.get('name'))
+		if not isinstance(item, str):
+			return set()
+		names.add(item)
+	return names
+
+async def _route_capabilities(smws_conn, local):
+	# return the capabilities of the connected solmate.
+	# they only change with the firmware, therefore they are persisted per serial number and connection type
+	# and only checked again if the firmware version differs from the one they were checked with
+	key = sol_utils.merged_config['eet_serial_number'] + ('_local' if local else '_cloud')
+	capabilities = sol_utils.load_state('capabilities')
+	cached = capabilities.get(key)
+
+	# the firmware version is only needed to compare it with the cached one or to persist the capabilities
+	version = None
+	if cached or sol_utils.merged_config['general_state_folder']:
+		info = await smws_conn.query_optional('get_solmate_info', {})
+		version = info.get('version') if info else None
+
+	if version and cached and cached['version'] == version:
+		sol_utils.logging('Websocket: Using cached capabilities of firmware: ' + str(version))
+		return dict(cached['routes'])
+
+	sol_utils.logging('Websocket: Checking capabilities of firmware: ' + str(version))
+
+	# routes listed in the api info need no extra request
+	# the api info does not list all routes (like boost), these are checked with a real request
+	# check_route returns true if the route exists and false if not, without a response it raises
+	response = await smws_conn.query_optional('get_api_info', {})
+	listed = _api_routes(response) if response else set()
+
+	routes = {}
+	for name, route in capability_routes.items():
+		routes[name] = route in listed or await smws_conn.check_route(route, {})
+
+	if version:
+		# only persist if we know for which firmware the capabilities are valid
+		capabilities[key] = {'version': version, 'routes': routes}
+		sol_utils.save_state('capabilities', capabilities)
+
+	return dict(routes)
+
+async def check_routes(smws_conn, local):
 
 	# check if we should *only* print the current API info response
 	# eases debugging the current published available routes
 	if sol_utils.merged_config['general_api_info']:
-		response = smws_conn.query_solmate('get_api_info', {})
+		response = await smws_conn.query_solmate('get_api_info', {})
 		print('\n\'get_api_info\' route info requested: \n')
 		print(json.dumps(response, ensure_ascii=False, indent=2, separators=(',', ': ')))
 		sys.exit()
 
 	# define api routes or behaviours that may not be available depending on the connection
-	api_available = {}
-
-	# the name is if seen 1:1 from the webUI, true | false
-	# some routes ares only available when connected locally but (currently) not via the cloud
-	# check_route returns true if the route exists and false if not
-	api_available['sun2plugHasBoostInjection'] = smws_conn.check_route('get_boost_injection', {})
-	api_available['hasUserSettings'] = smws_conn.check_route('get_injection_settings', {})
+	api_available = await _route_capabilities(smws_conn, local)
 
 	# the shutdown api has never a true response, we need to decide based on former information
 	api_available['shutdown'] = local
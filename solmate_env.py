@@ -4,11 +4,14 @@ import json
 import solmate_utils as sol_utils
 from dotenv import dotenv_values
 
-def process_env(version, self):
+def process_env(version, self, argument = None):
 	# get all environment variables as dictionary
 	# https://pypi.org/project/python-dotenv/
 	# file either predefined or as cmd line option. option ID starts with 2
+	# in fleet mode, the env file of the solmate is handed over as argument
 	env_file = '.env'
+	if argument is None and len(sys.argv) > 1:
+		argument = sys.argv[1]
 	merged_config = {}
 	ok = True
 
@@ -21,14 +24,14 @@ def process_env(version, self):
 	if self is None:
 		# type defaults to False like when using default install
 		# this is the case when you call e.g. python solmate.py <env-file>
-		if len(sys.argv) > 1:
+		if argument:
 			# use an env file if given as argument
-			if os.path.isfile(sys.argv[1]) == True:
-				env_file = sys.argv[1]
+			if os.path.isfile(argument) == True:
+				env_file = argument
 				message = 'Using env file: ' + str(env_file)
 			else:
 				ok = False
-				message = 'Envvar file: ' + str(sys.argv[1]) + ' as argument not found, exiting.'
+				message = 'Envvar file: ' + str(argument) + ' as argument not found, exiting.'
 		else:
 			# we excpect that the .env file is in THE SAME directory from which the script has been started!!
 			# if you start it from another directory, you must provide it as argument
@@ -52,7 +55,7 @@ def process_env(version, self):
 			message = 'No \'.env\' file found, expecting envvars.'
 
 	if not ok:
-		sol_utils.merged_config = merged_config
+		sol_utils.set_config(merged_config)
 		if not type:
 			# standard termination
 			sol_utils.logging(message)
@@ -77,8 +80,8 @@ def process_env(version, self):
 
 	# get the config values for the solmate
 	solmate_config = {k: v for k, v in fcl.items() if k.startswith('eet_')}
-		# timer values are all converted to an absolute integer
-	timer_config = {k: abs(int(v.strip() or 0)) for k, v in fcl.items() if k.startswith('timer_')}
+		# timer values are all converted to an absolute integer except the backoff factor, see '_timer_value'
+	timer_config = {k: _timer_value(k, v) for k, v in fcl.items() if k.startswith('timer_')}
 
 	# get the config values for general program configuration
 	general_config = {k: v for k, v in fcl.items() if k.startswith('general_')}
@@ -107,13 +110,16 @@ def process_env(version, self):
 		if not x:
 			merged_config[k] = False
 
+	# a backoff factor below 1 would shorten the waiting time with each failure
+	merged_config['timer_backoff_factor'] = max(1, merged_config['timer_backoff_factor'])
+
 	if not merged_config['general_use_mqtt']:
 		# if the use of mqtt is required
 		if not mqtt_config:
 			# but there is no mqtt config defined
 			message = 'There is no MQTT configuration, exiting.'
 			# set key to use 'sol_utils.logging' because merged_config has not been populated
-			sol_utils.merged_config = merged_config
+			sol_utils.set_config(merged_config)
 			sol_utils.logging(message)
 			sys.exit()
 
@@ -123,12 +129,47 @@ def process_env(version, self):
 
 	if not solmate_config:
 		message = 'There is no Solmate configuration, exiting.'
-		sol_utils.merged_config = merged_config
+		sol_utils.set_config(merged_config)
 		sol_utils.logging(message)
 		sys.exit()
 
 	# hand over the final array to be globally available
-	sol_utils.merged_config = merged_config
+	sol_utils.set_config(merged_config)
+
+	# states must not expire on the broker before they are published again
+	merged_config['timer_state_expiry'] = _state_expiry(merged_config)
+
+def _state_expiry(config):
+	# an unchanged state is published again with the heartbeat, but only when its route is queried next.
+	# if it expired before, HA shows the entities as unknown. the expiry is therefore raised to at least
+	# the heartbeat plus the longest interval a route is queried with. without heartbeat, states do not expire
+	expiry = config['timer_state_expiry']
+	if not expiry:
+		return expiry
+
+	heartbeat = config['timer_heartbeat']
+	if not heartbeat:
+		sol_utils.logging('Env: timer_state_expiry needs timer_heartbeat, states do not expire.')
+		return 0
+
+	intervals = [config['timer_live']] + [v for k, v in config.items() if k.startswith('timer_route_')]
+	if config['general_adaptive_polling']:
+		intervals.append(config['timer_live_max'])
+	if config['eet_latitude'] is not False and config['eet_longitude'] is not False:
+		intervals.append(config['timer_night'])
+
+	minimum = heartbeat + max(intervals)
+	if expiry < minimum:
+		sol_utils.logging('Env: timer_state_expiry raised to: ' + str(minimum) + 's (timer_heartbeat plus the longest query interval).')
+		return minimum
+	return expiry
+
+def _timer_value(key, value):
+	# convert a timer value to an absolute integer
+	# the backoff factor is a float like 1.5, it is not made absolute but capped when merged
+	if key == 'timer_backoff_factor':
+		return float(value.strip() or 0)
+	return abs(int(value.strip() or 0))
 
 def _add_optional_env(version, self):
 	# if the key does not exist, it is added with a default value.
@@ -152,11 +193,35 @@ def _add_optional_env(version, self):
 	# eet spare is new and defaults to empty
 	add_optional.setdefault('eet_spare_serial_number', False)
 
+	# the location of the solmate for the night mode, see solmate_polling.py
+	# the values are strings like '48.2', converted when used
+	add_optional.setdefault('eet_latitude', False)
+	add_optional.setdefault('eet_longitude', False)
+	# the solar elevation in degrees below which it is night, -6 is the end of civil twilight
+	add_optional.setdefault('eet_night_elevation', '-6')
+
+	# the standby server uri for the dual path mode, see solmate_failover.py
+	add_optional.setdefault('eet_server_uri_standby', False)
+
+	# the mqtt qos per class of topic, see solmate_mqtt.py
+	add_optional.setdefault('mqtt_qos_config', 2)
+	add_optional.setdefault('mqtt_qos_availability', 2)
+	add_optional.setdefault('mqtt_qos_state', 2)
+	add_optional.setdefault('mqtt_qos_command', 2)
+	# the paho in-flight window for qos 1 and 2 messages, not set uses the library default (20)
+	add_optional.setdefault('mqtt_max_inflight', False)
+
 	# general values are now autogenerated and defaulted, except if manually set
 	add_optional.setdefault('general_print_response', False)
 	add_optional.setdefault('general_use_mqtt', True)
 	add_optional.setdefault('general_api_info', False)
 	add_optional.setdefault('general_console_timestamp', False)
+	# send multiple websocket requests at once and correlate the responses by their id
+	add_optional.setdefault('general_ws_pipelining', True)
+	# adapt the live values interval to how fast the live data changes, see solmate_polling.py
+	add_optional.setdefault('general_adaptive_polling', False)
+	# publish one HA device discovery config instead of one per entity, see solmate_ha_config.py
+	add_optional.setdefault('general_ha_device_discovery', False)
 
 	# with appdaemon, dont print default to the console, except when manually defined
 	if self is None:
@@ -172,6 +237,10 @@ def _add_optional_env(version, self):
 	# internal only, define the location for custom special package installs
 	add_optional.setdefault('general_install_folder', 'my_packages')
 
+	# the folder below the install path where state like the session cache is persisted
+	# an empty value disables persisting state, it is then only kept in memory
+	add_optional.setdefault('general_state_folder', 'my_state')
+
 	# internal only, this is the path this script is located
 	# ending with a slash for ease of extension
 	add_optional.setdefault('general_install_path', os.path.join(os.path.dirname(os.path.abspath(__file__)), ''))
@@ -181,13 +250,52 @@ def _add_optional_env(version, self):
 	add_optional.setdefault('timer_offline', 600)
 	add_optional.setdefault('timer_conn_err', 10)
 	add_optional.setdefault('timer_live', 30)
+	# the interval of polled routes, defaults to 'timer_live' if not set, see solmate_polling.py
+	# settings change only when someone edits them, they are read back immediately after a write
+	add_optional.setdefault('timer_route_get_injection_settings', 300)
+	add_optional.setdefault('timer_route_get_boost_injection', 300)
+	# the interval all routes are queried at night
+	add_optional.setdefault('timer_night', 600)
+	# the bounds of the live values interval with adaptive polling
+	add_optional.setdefault('timer_live_min', 10)
+	add_optional.setdefault('timer_live_max', 120)
 	add_optional.setdefault('timer_reboot', 180)
 	add_optional.setdefault('timer_attempt_restart', 3)
+	# log collected metrics like the duration of a poll cycle every n seconds, 0 = off
+	add_optional.setdefault('timer_metrics', 0)
+	# publish the states to mqtt at least every n seconds even if they did not change, 0 = only on change
+	add_optional.setdefault('timer_heartbeat', 300)
+	# states published to mqtt expire on the broker after n seconds, 0 = never
+	add_optional.setdefault('timer_state_expiry', 0)
 
 	# add an internal only 1s value timer
 	# not exposed to .env-sample
 	add_optional.setdefault('timer_min', 1)
 
+	# the reconnect backoff, see solmate_reconnect.py
+	# factor each consecutive failure multiplies the waiting time with
+	add_optional.setdefault('timer_backoff_factor', 2)
+	# random jitter in percent applied to the waiting time
+	add_optional.setdefault('timer_backoff_jitter', 20)
+	# a connection must be up for that many seconds to reset the backoff
+	add_optional.setdefault('timer_backoff_reset', 300)
+
+	# the seconds to wait for the response of a websocket request
+	# can be defined per route with 'timer_request_<route>'
+	add_optional.setdefault('timer_request', 10)
+	add_optional.setdefault('timer_request_live_values', 5)
+	add_optional.setdefault('timer_request_get_api_info', 30)
+	add_optional.setdefault('timer_request_logs', 60)
+
+	# dual path mode, the minimum seconds between attempts to establish the standby connection
+	add_optional.setdefault('timer_standby', 60)
+
+	# reachability probes, see solmate_probe.py
+	# timeout of a single probe
+	add_optional.setdefault('timer_probe', 2)
+	# how long resolved host addresses are cached
+	add_optional.setdefault('timer_dns_cache', 300)
+
 	# these are the currently known default values extracted from the webUI
 	add_optional.setdefault('default_boost_set_time', 600)
 	add_optional.setdefault('default_boost_injection_wattage', boost_max_wattage)
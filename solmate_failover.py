@@ -0,0 +1,135 @@
+import asyncio
+import solmate_connect as sol_connect
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+# dual path mode, only active if 'eet_server_uri_standby' is configured.
+# the configured 'eet_server_uri' is the primary path, typically the local connection,
+# 'eet_server_uri_standby' the secondary one, typically the cloud.
+# while polling on the active path, an authenticated session on the other path is kept as standby.
+# if the active path fails, polling moves to the standby within the same cycle instead of waiting
+# for a reconnect. when running on the secondary path and the primary one is back, polling moves back.
+# the standby is (re)established in the background, at most every 'timer_standby' seconds.
+
+class dual_path:
+	# keeps track of the active path and the standby session
+
+	def __init__(self):
+		self.uris = {
+			'primary': sol_utils.merged_config['eet_server_uri'],
+			'secondary': sol_utils.merged_config['eet_server_uri_standby']
+		}
+		self.active = 'primary'			# the path polling runs on
+		self.standby = None				# (path, smws_conn, online, local, api_available)
+		self.task = None				# task establishing the standby
+		self.last_attempt = None		# when establishing the standby was started the last time
+
+	def enabled(self):
+		# dual path mode is only used if a standby uri is configured
+		return bool(self.uris['secondary'])
+
+	def active_uri(self):
+		# the uri polling runs on
+		return self.uris[self.active]
+
+	def _other(self):
+		return 'secondary' if self.active == 'primary' else 'primary'
+
+	async def _connect(self, path):
+		# connect and authenticate to the path and get its available routes
+		smws_conn, online, local = await sol_connect.connect_solmate(self.uris[path])
+		try:
+			api_available = await sol_connect.check_routes(smws_conn, local)
+		except Exception:
+			await smws_conn.close()
+			raise
+		return path, smws_conn, online, local, api_available
+
+	async def _drop_standby(self):
+		# close the standby session and stop establishing one
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+		if self.standby is not None:
+			await self.standby[1].close()
+			self.standby = None
+
+	async def _collect(self):
+		# take over the result of establishing the standby in the background if finished
+		if self.task is None or not self.task.done():
+			return
+		try:
+			self.standby = self.task.result()
+			sol_utils.logging('Main: Standby path connected: ' + self.uris[self.standby[0]])
+		except Exception as err:
+			sol_utils.logging('Main: Standby path not available: ' + self.uris[self._other()])
+		self.task = None
+
+	def _switch(self, start, metric):
+		# make the standby the active path and return its connection data
+		path, smws_conn, online, local, api_available = self.standby
+		self.standby = None
+		self.active = path
+		# the path just left needs time, do not try to reach it immediately
+		self.last_attempt = sol_metrics.now()
+
+		duration = sol_metrics.record_since(metric, start)
+		sol_utils.logging('Main: Switched to the ' + path + ' path in ' + format(duration, '.1f') + 's: ' + self.uris[path])
+		return smws_conn, online, local, api_available
+
+	async def primary_connected(self):
+		# a regular (re)connect always goes to the primary path, the standby is the secondary one
+		if not self.enabled():
+			return
+		if self.active != 'primary':
+			await self._drop_standby()
+		self.active = 'primary'
+
+	async def keep_standby(self):
+		# called each poll cycle to (re)establish the standby in the background if necessary
+		# returns the connection data to switch to if the primary path is back, else none
+		if not self.enabled():
+			return None
+
+		start = sol_metrics.now()
+		await self._collect()
+
+		if self.standby is not None and not self.standby[1].is_open():
+			sol_utils.logging('Main: Standby path lost: ' + self.uris[self.standby[0]])
+			await self._drop_standby()
+
+		if self.standby is None and self.task is None:
+			if self.last_attempt is None or start - self.last_attempt >= sol_utils.merged_config['timer_standby']:
+				self.last_attempt = start
+				self.task = asyncio.ensure_future(self._connect(self._other()))
+
+		if self.standby is not None and self.standby[0] == 'primary':
+			# move back to the primary path
+			return self._switch(start, 'failback')
+
+		return None
+
+	async def failover(self):
+		# the active path failed, switch to the standby
+		# if there is no standby yet, try to establish it now
+		# returns the connection data of the standby or none if it is not available
+		if not self.enabled():
+			return None
+
+		start = sol_metrics.now()
+		if self.task is not None:
+			# establishing the standby is in progress, wait for it
+			await asyncio.wait([self.task])
+			await self._collect()
+
+		if self.standby is not None and not self.standby[1].is_open():
+			await self._drop_standby()
+
+		if self.standby is None:
+			try:
+				self.standby = await self._connect(self._other())
+			except Exception:
+				sol_utils.logging('Main: Standby path not available: ' + self.uris[self._other()])
+				return None
+
+		return self._switch(start, 'failover')
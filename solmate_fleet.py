@@ -0,0 +1,28 @@
+import asyncio
+import os
+import solmate_main as sol_main
+import solmate_utils as sol_utils
+
+# fleet mode: one process handles multiple solmates, each configured by its own env file
+# python solmate.py <env-file-1> <env-file-2> ...
+# each solmate runs 'sol_main.main' in its own task with its own config, websocket session, state and queue.
+# all share the one event loop and, if they use the same broker, one mqtt connection.
+# an unrecoverable error of one solmate ends the program like without fleet mode.
+
+async def _run_device(env_file):
+	# the device is set in the context of this task only, see 'sol_utils.device'
+	# the name of the env file prefixes the log messages of the solmate
+	name = os.path.basename(env_file)
+	sol_utils.current_device.set(sol_utils.device(name))
+	await sol_main.main(None, env_file)
+
+async def main(env_files):
+	# the default device is only used for logging outside of any solmate like on keyboard interrupts
+	sol_utils.set_config({
+		'general_console_print': True,
+		'general_console_timestamp': False,
+		'internal_access_self': None
+	})
+	sol_utils.logging('Main: Fleet mode with ' + str(len(env_files)) + ' Solmates.')
+
+	await asyncio.gather(*[_run_device(env_file) for env_file in env_files])
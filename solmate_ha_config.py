@@ -1,801 +1,687 @@
-import json
+import solmate_codec as sol_codec
 import solmate_utils as sol_utils
 
 # the ha config setup is quite big so it is defined in an own file making mqtt better readable.
-# the init parameters from 'self' are handed over and used as 'c_s'
-
-def construct_ha_config_message(c_s):
-
-	# it is EXTREMELY important to have the correct component set so that HA does the correct thing
-	#
-	# <discovery_prefix>/<component>/[<node_id>/]<object_id>/config|availability|state
-	# c_s.mqtt_config_topic + names[i] + '/config'
-	# https://www.home-assistant.io/integrations/mqtt/#mqtt-discovery
-	# https://www.home-assistant.io/integrations/sensor.mqtt/
-	# https://www.home-assistant.io/integrations/sensor/#device-class
-	# https://developers.home-assistant.io/docs/core/entity/sensor/#available-state-classes
-	# https://pictogrammers.com/library/mdi/
-
-	names = ['']			# assembled as '/' + virtual_topic + fake_name
-	fake_names = ['']		# the name used in the mqtt message
-	real_names = ['']		# the name used for the solmate API to get/set values
-							# real/fake names can be different !
-							# for automatic status updates, names in different topics must be identical
-							# some naming differences take place like for 'set_user_maximum_injection'
-							# technically this mapping is only necessary for writable keys 
-	route = ['']			# the route for writable entities, needed for the solmate API
-	configs = ['']			# the assembled config for each entry
-	config_topics = ['']	# the topic for HA auto-config
-
-	# note that device_values must be populated
-	device_values = {}
-	device_values['identifiers'] = sol_utils.merged_config['mqtt_topic'] + '_' + sol_utils.merged_config['eet_serial_number'] # ['eet_solmate']
-	device_values['name'] = sol_utils.merged_config['mqtt_topic'] #'SOLMATE'
-	device_values['model'] = 'SOLMATE G'
-	device_values['manufacturer'] = 'EET Energy'
-	device_values['serial_number'] = sol_utils.merged_config['eet_serial_number']
-
-	if sol_utils.merged_config['eet_spare_serial_number']:
-		device_values['via_device'] = sol_utils.merged_config['eet_spare_serial_number']
-
-	# virtual topics
-	live = '/live'
-	live_n = 'live_'
-	info = '/info'
-	info_n = 'info_'
-	button = '/button'
-	button_n = 'button_'
-	get_injection ='/get_injection'
-	get_injection_n = 'get_injection_'
-	get_boost = '/get_boost'
-	get_boost_n = 'get_boost_'
-	set_boost = '/set_boost'
-	set_boost_n = 'set_boost_'
-	set_inject = '/set_inject'
-	set_inject_n = 'set_inject_'
-	dictionaries = {}
-
-# route: 'live_values'
-# collection of live data. queried in relative short intervals
-	i = 0
-	route[i] = False
-	fake_names[i] = 'timestamp'
-	real_names[i] = 'timestamp'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# give the entiy a better identifyable name for the UI (timestamp is multiple present)
-		# dont use a timestamp class, we manually generate it and manually define the icon
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ (value_json.' + fake_names[i] + " | as_timestamp()) | timestamp_custom('%Y-%m-%d %H:%M:%S') }}",
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'device': device_values,
-		'icon': 'mdi:progress-clock',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'pv_power'
-	real_names[i] = 'pv_power'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:solar-power-variant-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'inject_power'
-	real_names[i] = 'inject_power'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-	'name': name,
-	'device_class': 'power',
-	'state_topic': c_s.mqtt_sensor_topic + live,
-	'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-	'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-	'availability_topic': c_s.mqtt_availability_topic,
-	'unit_of_measurement': 'W',
-	'device': device_values,
-	'icon': 'mdi:transmission-tower-import',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'battery_flow'
-	real_names[i] = 'battery_flow'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:home-battery-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'battery_state'
-	real_names[i] = 'battery_state'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ ((value_json.' + fake_names[i] + ' | float(0)) * 100) | round(1) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unit_of_measurement': '%',
-		'device': device_values,
-		'icon': 'mdi:battery-high',
-		'retain': True
+# all entities are described in the 'entities' table below. 'compile_registry' resolves the table
+# for one solmate into a registry that serves the configs to publish and the lookups of entities.
+# the configs are either published per entity or, with 'general_ha_device_discovery', as one
+# device config listing all entities as components (HA 2024.11 and newer).
+# the init parameters from 'self' of solmate_mqtt are handed over and used as 'c_s'
+#
+# it is EXTREMELY important to have the correct component set so that HA does the correct thing
+#
+# <discovery_prefix>/<component>/[<node_id>/]<object_id>/config|availability|state
+# <discovery_prefix>/device/<object_id>/config
+# https://www.home-assistant.io/integrations/mqtt/#mqtt-discovery
+# https://www.home-assistant.io/integrations/mqtt/#device-discovery-payload
+# https://www.home-assistant.io/integrations/sensor.mqtt/
+# https://www.home-assistant.io/integrations/sensor/#device-class
+# https://developers.home-assistant.io/docs/core/entity/sensor/#available-state-classes
+# https://pictogrammers.com/library/mdi/
+
+class _placeholder:
+	# a value of an entity config that depends on the solmate and is resolved when compiling
+
+	def __init__(self, resolve):
+		self.resolve = resolve		# function(entity, registry) returning the value
+
+_name = _placeholder(lambda e, r: e.object_id)
+_state_topic = _placeholder(lambda e, r: r.c_s.mqtt_sensor_topic + '/' + e.endpoint)
+_command_topic = _placeholder(lambda e, r: e.command_topic)
+_unique_id = _placeholder(lambda e, r: r.serial_number + '_' + e.object_id)
+# the name used can be read and written, so we need to distinguish
+_read_unique_id = _placeholder(lambda e, r: r.serial_number + '_read_' + e.object_id)
+_device = _placeholder(lambda e, r: r.device)
+_qos_command = _placeholder(lambda e, r: r.c_s.mqtt_qos_command)
+# entities requiring a route not available are bound to a topic that is never available
+_availability_topic = _placeholder(lambda e, r: r.c_s.mqtt_availability_topic
+	if not e.requires or r.c_s.api_available[e.requires] else r.c_s.mqtt_never_available_topic)
+
+def _config(key):
+	# a value from the config like a default limit
+	return _placeholder(lambda e, r: sol_utils.merged_config[key])
+
+# each entity is described by a dictionary:
+#	component:	the HA component, 'sensor', 'number' or 'button'
+#	group:		prefixes the name to get the object id like 'live_pv_power'
+#	name:		the name used in the mqtt message (fake name)
+#	real_name:	the name used for the solmate API to set the value, defaults to the name
+#				real/fake names can be different! for automatic status updates, names in different topics must be identical
+#	route:		the route for writable entities, needed for the solmate API
+#	endpoint:	the state topic the value is published to, see 'sol_main.route_endpoints'
+#	requires:	the key in 'api_available' the entity depends on, if not available the entity is never available
+#	config:		the HA config, placeholders are resolved when compiling
+
+entities = [
+	# route: 'live_values'
+	# collection of live data. queried in relative short intervals
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'timestamp',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': "{{ (value_json.timestamp | as_timestamp()) | timestamp_custom('%Y-%m-%d %H:%M:%S') }}",
+			'availability_topic': _availability_topic,
+			'unique_id': _unique_id,
+			'device': _device,
+			'icon': 'mdi:progress-clock',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'pv_power',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.pv_power | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:solar-power-variant-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'inject_power',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.inject_power | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:transmission-tower-import',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'battery_flow',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.battery_flow | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:home-battery-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'battery_state',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ ((value_json.battery_state | float(0)) * 100) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': '%',
+			'device': _device,
+			'icon': 'mdi:battery-high',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'temperature',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'device_class': 'temperature',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.temperature | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': '°C',
+			'device': _device,
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'live',
+		'name': 'mppOutI',
+		'endpoint': 'live',
+		'config': {
+			'name': _name,
+			'device_class': 'current',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.mppOutI | float(0)) | round(2) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'unit_of_measurement': 'A',
+			'retain': True,
+		}
+	},
+	# route: 'get_solmate_info'
+	# collection of info data like SW version. queried like once a day
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'version',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.version | version }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:text-box-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'ip',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.ip }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:ip-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'timestamp',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': "{{ (value_json.timestamp | as_timestamp()) | timestamp_custom('%Y-%m-%d %H:%M:%S') }}",
+			'availability_topic': _availability_topic,
+			'unique_id': _unique_id,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:clock-time-ten',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'operating_state',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.operating_state }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:power-settings',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'esham_version',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.esham_version }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:text-box-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'info',
+		'name': 'connected_to',
+		'endpoint': 'info',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.connected_to }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'device': _device,
+			'entity_category': 'diagnostic',
+			'icon': 'mdi:lan-connect',
+			'retain': True,
+		}
+	},
+	# collection of system switches like reboot
+	# add all switches/buttons here to be part of the system hierarchy
+	{
+		'component': 'button',
+		'group': 'button',
+		'name': 'reboot',
+		'requires': 'shutdown',
+		'config': {
+			'name': _name,
+			'command_topic': _command_topic,
+			'availability_topic': _availability_topic,
+			'unique_id': _unique_id,
+			'value_template': '{{ value_json.reboot }}',
+			'device': _device,
+			'entity_category': 'config',
+			'device_class': 'restart',
+			'payload_press': 'doit',
+			'qos': _qos_command,
+			'retain': False,
+		}
+	},
+	# route: 'get_injection_settings'
+	# collection of existing injection settings
+	{
+		'component': 'sensor',
+		'group': 'get_injection',
+		'name': 'user_minimum_injection',
+		'requires': 'hasUserSettings',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.user_minimum_injection | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:home-lightning-bolt-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'get_injection',
+		'name': 'user_maximum_injection',
+		'requires': 'hasUserSettings',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.user_maximum_injection | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:home-lightning-bolt',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'get_injection',
+		'name': 'user_minimum_battery_percentage',
+		'requires': 'hasUserSettings',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ ((value_json.user_minimum_battery_percentage | float(0)) | round(1)) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': '%',
+			'device': _device,
+			'icon': 'mdi:battery-low',
+			'retain': True,
+		}
+	},
+	# route: 'get_boost_injection'
+	# collection of existing boost injection settings
+	{
+		'component': 'sensor',
+		'group': 'get_boost',
+		'name': 'set_time',
+		'requires': 'sun2plugHasBoostInjection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.set_time | int(0)) }}',
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 's',
+			'unique_id': _read_unique_id,
+			'device': _device,
+			'icon': 'mdi:timer-play-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'get_boost',
+		'name': 'set_wattage',
+		'requires': 'sun2plugHasBoostInjection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.set_wattage | float(0)) | round(1) }}',
+			'unique_id': _read_unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:home-lightning-bolt',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'get_boost',
+		'name': 'remaining_time',
+		'requires': 'sun2plugHasBoostInjection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'state_topic': _state_topic,
+			'value_template': '{{ value_json.remaining_time | int(0) }}',
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 's',
+			'unique_id': _unique_id,
+			'device': _device,
+			'icon': 'mdi:av-timer',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'sensor',
+		'group': 'get_boost',
+		'name': 'actual_wattage',
+		'requires': 'sun2plugHasBoostInjection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'device_class': 'power',
+			'state_topic': _state_topic,
+			'value_template': '{{ (value_json.actual_wattage | float(0)) | round(1) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:transmission-tower-import',
+			'retain': True,
+		}
+	},
+	# collection of user definable values like min/maximum_injection and minimum_battery_percentage etc
+	# set boost, time and wattage must be sent together
+	{
+		'component': 'number',
+		'group': 'set_boost',
+		'name': 'set_wattage',
+		'requires': 'sun2plugHasBoostInjection',
+		'real_name': 'wattage',
+		'route': 'set_boost_injection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'entity_category': 'config',
+			'max': _config('default_boost_injection_wattage'),
+			'min': 0, # hardcoded, see note in solmate_env.py
+			'step': 5,
+			'mode': 'slider',
+			'state_topic': _state_topic,
+			'device_class': 'power',
+			'command_topic': _command_topic,
+			'value_template': '{{ value_json.set_wattage | int(0) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:home-plus-outline',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'number',
+		'group': 'set_boost',
+		'name': 'set_time',
+		'requires': 'sun2plugHasBoostInjection',
+		'real_name': 'time',
+		'route': 'set_boost_injection',
+		'endpoint': 'get_boost',
+		'config': {
+			'name': _name,
+			'entity_category': 'config',
+			'max': _config('default_max_boost_time'),
+			'min': _config('default_min_boost_time'),
+			'step': 60,
+			'mode': 'slider',
+			'state_topic': _state_topic,
+			'command_topic': _command_topic,
+			'value_template': '{{ value_json.set_time | int(0) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 's',
+			'device': _device,
+			'icon': 'mdi:home-clock-outline',
+			'retain': True,
+		}
+	},
+	# set inject
+	{
+		'component': 'number',
+		'group': 'set_inject',
+		'name': 'user_minimum_injection',
+		'requires': 'hasUserSettings',
+		'real_name': 'injection',
+		'route': 'set_user_minimum_injection',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'entity_category': 'config',
+			'max': _config('default_user_maximum_injection'),
+			'min': 0,
+			'step': 5,
+			'mode': 'slider',
+			'state_topic': _state_topic,
+			'device_class': 'power',
+			'command_topic': _command_topic,
+			'value_template': '{{ value_json.user_minimum_injection | int(0) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:priority-low',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'number',
+		'group': 'set_inject',
+		'name': 'user_maximum_injection',
+		'requires': 'hasUserSettings',
+		'real_name': 'injection',
+		'route': 'set_user_maximum_injection',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'entity_category': 'config',
+			'max': _config('default_user_maximum_injection'),
+			'min': _config('default_user_minimum_injection'),
+			'step': 5,
+			'mode': 'slider',
+			'state_topic': _state_topic,
+			'device_class': 'power',
+			'command_topic': _command_topic,
+			'value_template': '{{ value_json.user_maximum_injection | int(0) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': 'W',
+			'device': _device,
+			'icon': 'mdi:priority-high',
+			'retain': True,
+		}
+	},
+	{
+		'component': 'number',
+		'group': 'set_inject',
+		'name': 'user_minimum_battery_percentage',
+		'requires': 'hasUserSettings',
+		'real_name': 'battery_percentage',
+		'route': 'set_user_minimum_battery_percentage',
+		'endpoint': 'get_injection',
+		'config': {
+			'name': _name,
+			'entity_category': 'config',
+			'max': _config('default_max_battery'), # hardcoded, see note in solmate_env.py
+			'min': _config('default_user_minimum_battery_percentage'),
+			'step': 5,
+			'mode': 'slider',
+			'state_topic': _state_topic,
+			'command_topic': _command_topic,
+			'value_template': '{{ value_json.user_minimum_battery_percentage | int(0) }}',
+			'unique_id': _unique_id,
+			'availability_topic': _availability_topic,
+			'unit_of_measurement': '%',
+			'device': _device,
+			'icon': 'mdi:battery-low',
+			'retain': True,
+		}
 	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	route[i] = False
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	fake_names[i] = 'temperature'
-	real_names[i] = 'temperature'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'temperature',
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unit_of_measurement': '°C',
-		'device': device_values,
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'mppOutI'
-	real_names[i] = 'mppOutI'
-	name = live_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'current',
-		'state_topic': c_s.mqtt_sensor_topic + live,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(2) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'unit_of_measurement': 'A',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# route: 'get_solmate_info'
-# collection of info data like SW version. queried like once a day 
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'version'
-	real_names[i] = 'version'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# no device class here as it is a string
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ value_json.' + fake_names[i] + ' | version }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:text-box-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'ip'
-	real_names[i] = 'ip'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# no device class here as it is a string
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ value_json.' + fake_names[i] + ' }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:ip-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'timestamp'
-	real_names[i] = 'timestamp'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# give the entiy a better identifyable name for the UI (timestamp is multiple present)
-		# dont use a timestamp class, we manually generate it and manually define the icon
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ (value_json.' + fake_names[i] + " | as_timestamp()) | timestamp_custom('%Y-%m-%d %H:%M:%S') }}",
-		'availability_topic': c_s.mqtt_availability_topic,
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:clock-time-ten',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'operating_state'
-	real_names[i] = 'operating_state'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# no device class here as it is a string
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ value_json.' + fake_names[i] + ' }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:power-settings',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'esham_version'
-	real_names[i] = 'esham_version'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# no device class here as it is a string
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ value_json.' + fake_names[i] + ' }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:text-box-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'connected_to'
-	real_names[i] = 'connected_to'
-	name = info_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		# no device class here as it is a string
-		'state_topic': c_s.mqtt_sensor_topic + info,
-		'value_template': '{{ value_json.' + fake_names[i] + ' }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': c_s.mqtt_availability_topic,
-		'device': device_values,
-		'entity_category': 'diagnostic',
-		'icon': 'mdi:lan-connect',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# collection of system switches like reboot
-# add all switches/buttons here to be part of the system hierarchy
-	dynamic_topic = c_s.mqtt_availability_topic if c_s.api_available['shutdown'] else c_s.mqtt_never_available_topic
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'reboot'
-	real_names[i] = 'reboot'
-	name = button_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_button_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'command_topic': c_s.mqtt_button_topic + '/command/' + fake_names[i],
-		'availability_topic': dynamic_topic,
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'value_template': '{{ value_json.' + fake_names[i] + ' }}',
-		'device': device_values,
-		'entity_category': 'config',
-		'device_class': 'restart',
-		'payload_press': 'doit',
-		'qos': c_s.mqtt_qos,
-		'retain': False
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# route: 'get_injection_settings'
-# collection of existing injection settings, queried in the same interval of live values
-	dynamic_topic = c_s.mqtt_availability_topic if c_s.api_available['hasUserSettings'] else c_s.mqtt_never_available_topic
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'user_minimum_injection'
-	real_names[i] = 'user_minimum_injection'
-	name = get_injection_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + get_injection,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id':sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:home-lightning-bolt-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'user_maximum_injection'
-	real_names[i] = 'user_maximum_injection'
-	name = get_injection_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + get_injection,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id':sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:home-lightning-bolt',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'user_minimum_battery_percentage'
-	real_names[i] = 'user_minimum_battery_percentage'
-	name = get_injection_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'state_topic': c_s.mqtt_sensor_topic + get_injection,
-		'value_template': '{{ ((value_json.' + fake_names[i] + ' | float(0)) | round(1)) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': '%',
-		'device': device_values,
-		'icon': 'mdi:battery-low',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# route: 'get_boost_injection'
-# collection of existing boost injection settings, queried in the same interval of live values 
-	dynamic_topic = c_s.mqtt_availability_topic if c_s.api_available['sun2plugHasBoostInjection'] else c_s.mqtt_never_available_topic
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'set_time'
-	real_names[i] = 'set_time'
-	name = get_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | int(0)) }}',
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 's',
-		# the name used can be read and written, so we need to distinguish
-		'unique_id':sol_utils.merged_config['eet_serial_number'] + '_read_' + name,
-		'device': device_values,
-		'icon': 'mdi:timer-play-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'set_wattage'
-	real_names[i] = 'set_wattage'
-	name = get_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		# the name used can be read and written, so we need to distinguish
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_read_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:home-lightning-bolt',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'remaining_time'
-	real_names[i] = 'remaining_time'
-	name = get_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 's',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'device': device_values,
-		'icon': 'mdi:av-timer',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = False
-	fake_names[i] = 'actual_wattage'
-	real_names[i] = 'actual_wattage'
-	name = get_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_sensor_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'device_class': 'power',
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'value_template': '{{ (value_json.' + fake_names[i] + ' | float(0)) | round(1) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:transmission-tower-import',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# collection of user definable values like min/maximum_injection and minimum_battery_percentage etc
-# set boost
-	dynamic_topic = c_s.mqtt_availability_topic if c_s.api_available['sun2plugHasBoostInjection'] else c_s.mqtt_never_available_topic
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = 'set_boost_injection'
-	fake_names[i] = 'set_wattage'
-	real_names[i] = 'wattage'
-	name = set_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_number_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'entity_category': 'config',
-		'max': sol_utils.merged_config['default_boost_injection_wattage'],
-		'min': 0, # hardcoded, see note in solmate_env.py
-		'step': 5,
-		'mode': 'slider',
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'device_class': 'power',
-		'command_topic': c_s.mqtt_number_topic + '/' + fake_names[i],
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:home-plus-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = 'set_boost_injection'
-	fake_names[i] = 'set_time'
-	real_names[i] = 'time'
-	name = set_boost_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_number_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'entity_category': 'config',
-		'max': sol_utils.merged_config['default_max_boost_time'],
-		'min': sol_utils.merged_config['default_min_boost_time'],
-		'step': 60,
-		'mode': 'slider',
-		'state_topic': c_s.mqtt_sensor_topic + get_boost,
-		'command_topic': c_s.mqtt_number_topic + '/' + fake_names[i],
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 's',
-		'device': device_values,
-		'icon': 'mdi:home-clock-outline',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-# set inject
-	dynamic_topic = c_s.mqtt_availability_topic if c_s.api_available['hasUserSettings'] else c_s.mqtt_never_available_topic
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = 'set_user_minimum_injection'
-	fake_names[i] = 'user_minimum_injection'
-	real_names[i] = 'injection'
-	name = set_inject_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_number_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'entity_category': 'config',
-		'max': sol_utils.merged_config['default_user_maximum_injection'],
-		'min': 0,
-		'step': 5,
-		'mode': 'slider',
-		'state_topic': c_s.mqtt_sensor_topic + get_injection, 
-		'device_class': 'power',
-		'command_topic': c_s.mqtt_number_topic + '/' + fake_names[i],
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:priority-low',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = 'set_user_maximum_injection'
-	fake_names[i] = 'user_maximum_injection'
-	real_names[i] = 'injection'
-	name = set_inject_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_number_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'entity_category': 'config',
-		'max': sol_utils.merged_config['default_user_maximum_injection'],
-		'min': sol_utils.merged_config['default_user_minimum_injection'],
-		'step': 5,
-		'mode': 'slider',
-		'state_topic': c_s.mqtt_sensor_topic + get_injection, 
-		'device_class': 'power',
-		'command_topic': c_s.mqtt_number_topic + '/' + fake_names[i],
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': 'W',
-		'device': device_values,
-		'icon': 'mdi:priority-high',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	i += 1
-	route.append(1)
-	names.append(1)
-	fake_names.append(1)
-	real_names.append(1)
-	configs.append(1)
-	config_topics.append(1)
-	route[i] = 'set_user_minimum_battery_percentage'
-	fake_names[i] = 'user_minimum_battery_percentage'
-	real_names[i] = 'battery_percentage'
-	name = set_inject_n + fake_names[i]
-	names[i] = '/' + name
-	config_topics[i] = c_s.mqtt_number_config_topic
-	dictionaries[name] = {
-		'name': name,
-		'entity_category': 'config',
-		'max': sol_utils.merged_config['default_max_battery'], # hardcoded, see note in solmate_env.py
-		'min': sol_utils.merged_config['default_user_minimum_battery_percentage'],
-		'step': 5,
-		'mode': 'slider',
-		'state_topic': c_s.mqtt_sensor_topic + get_injection, 
-		'command_topic': c_s.mqtt_number_topic + '/' + fake_names[i],
-		'value_template': '{{ value_json.' + fake_names[i] + ' | int(0) }}',
-		'unique_id': sol_utils.merged_config['eet_serial_number'] + '_' + name,
-		'availability_topic': dynamic_topic,
-		'unit_of_measurement': '%',
-		'device': device_values,
-		'icon': 'mdi:battery-low',
-		'retain': True
-	}
-	configs[i] = json.dumps(dictionaries[name])
-
-	# json_formatted_str = json.dumps(dictionaries[name], indent=2, ensure_ascii = False)
-	# print(json_formatted_str)
-
-	return fake_names, real_names, route, names, configs, config_topics
+]
+
+# the keys of each entity config holding a placeholder, determined once
+_placeholder_keys = [[k for k, v in d['config'].items() if isinstance(v, _placeholder)] for d in entities]
+
+class entity:
+	# an entity of the table resolved for one solmate
+	# the config is resolved and serialized only when first needed
+
+	def __init__(self, description, placeholder_keys, registry):
+		self.registry = registry
+		self.placeholder_keys = placeholder_keys
+		self.component = description['component']
+		self.fake_name = description['name']
+		self.real_name = description.get('real_name', self.fake_name)
+		self.route = description.get('route', False)
+		self.endpoint = description.get('endpoint')
+		self.requires = description.get('requires')
+		self.template = description['config']
+		self.object_id = description['group'] + '_' + self.fake_name
+		c_s = registry.c_s
+		self.config_topic = getattr(c_s, 'mqtt_' + self.component + '_config_topic') + '/' + self.object_id + '/config'
+		self.command_topic = None
+		if 'command_topic' in self.template:
+			tree = c_s.mqtt_button_topic + '/command' if self.component == 'button' else c_s.mqtt_number_topic
+			self.command_topic = tree + '/' + self.fake_name
+		self._config = None
+		self._payload = None
+
+	@property
+	def config(self):
+		# the HA config as dictionary
+		if self._config is None:
+			config = dict(self.template)
+			for key in self.placeholder_keys:
+				config[key] = config[key].resolve(self, self.registry)
+			bridge_topic = self.registry.c_s.mqtt_bridge_topic
+			if bridge_topic:
+				# in fleet mode, the last will of the shared connection is sent to the bridge topic
+				# all entities must be available on their own and the bridge topic to become available
+				config['availability'] = [
+					{'topic': config.pop('availability_topic')},
+					{'topic': bridge_topic}
+				]
+				config['availability_mode'] = 'all'
+			self._config = config
+		return self._config
+
+	@property
+	def payload(self):
+		# the HA config serialized to publish
+		if self._payload is None:
+			self._payload = sol_codec.dumps(self.config)
+		return self._payload
+
+class entity_registry:
+	# the entities of one solmate with lookups by object id, command topic, endpoint and route
+
+	def __init__(self, c_s):
+		self.c_s = c_s
+		self.serial_number = sol_utils.merged_config['eet_serial_number']
+
+		# note that device_values must be populated
+		self.device = {}
+		self.device['identifiers'] = sol_utils.merged_config['mqtt_topic'] + '_' + sol_utils.merged_config['eet_serial_number'] # ['eet_solmate']
+		self.device['name'] = sol_utils.merged_config['mqtt_topic'] #'SOLMATE'
+		self.device['model'] = 'SOLMATE G'
+		self.device['manufacturer'] = 'EET Energy'
+		self.device['serial_number'] = sol_utils.merged_config['eet_serial_number']
+
+		if sol_utils.merged_config['eet_spare_serial_number']:
+			self.device['via_device'] = sol_utils.merged_config['eet_spare_serial_number']
+
+		self.entities = [entity(description, keys, self) for description, keys in zip(entities, _placeholder_keys)]
+
+		# the topic of the device config
+		self.device_topic = c_s.mqtt_ha + '/device/' + c_s.mqtt_topic + '/config'
+		self._device_payload = None
+
+		self.by_name = {e.object_id: e for e in self.entities}
+		self.by_command = {e.command_topic: e for e in self.entities if e.command_topic}
+		self.by_endpoint = {}
+		self.by_route = {}
+		for e in self.entities:
+			if e.endpoint:
+				self.by_endpoint.setdefault(e.endpoint, []).append(e)
+			if e.route:
+				self.by_route.setdefault(e.route, []).append(e)
+
+	@property
+	def device_payload(self):
+		# the device config with all entities as components, serialized when first needed
+		# the device is defined once for all components, the platform is the HA component
+		if self._device_payload is None:
+			components = {}
+			for e in self.entities:
+				config = {'platform': e.component}
+				config.update(e.config)
+				config.pop('device', None)
+				components[e.object_id] = config
+			self._device_payload = sol_codec.dumps({
+				'device': self.device,
+				'origin': {
+					'name': 'esham',
+					'sw_version': sol_utils.merged_config['internal_esham_version'],
+					'support_url': 'https://github.com/mmattel/EET-Solmate'
+				},
+				'components': components
+			})
+		return self._device_payload
+
+def compile_registry(c_s):
+	# resolve the entity table for the solmate of c_s
+	return entity_registry(c_s)
@@ -0,0 +1,96 @@
+import time
+from datetime import datetime, timedelta
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+# a small scheduler for jobs like the once a day query of the solmate info, running on the main event loop
+# a job is a coroutine function and identified by its name, registering a name again replaces the job.
+# jobs are registered once, the connections are handed over when running them and are therefore never stale.
+# when a job successfully ran the last time is persisted per serial number in the 'general_state_folder'.
+# a job missed while the program was not running or not connected is run as soon as possible.
+# a job that raises does not count as run and is retried with the next call after reconnecting.
+# a job that returns False failed too and is retried after 'timer_live' seconds.
+# a job registered with 'at_start' runs when the program starts, except it already ran today.
+# the duration of each job is recorded as metric 'job_<name>'.
+
+class job_scheduler:
+
+	def __init__(self):
+		self.jobs = {}		# name --> job
+		self.key = 'jobs_' + str(sol_utils.merged_config.get('eet_serial_number'))
+		# when each job ran the last time (wall clock), persisted
+		self.last_run = sol_utils.load_state('jobs').get(self.key, {})
+		# when a failed job is retried (wall clock), not persisted
+		self.retry_at = {}
+
+	def daily(self, name, callback, at, at_start = False):
+		# run the job every day at the local time given as 'HH:MM'
+		hour, minute = (int(x) for x in at.split(':'))
+		self._register(name, callback, at_start, lambda last: _next_time(last, timedelta(days = 1), hour = hour, minute = minute))
+
+	def hourly(self, name, callback, minute = 0, at_start = False):
+		# run the job every hour at the minute given
+		self._register(name, callback, at_start, lambda last: _next_time(last, timedelta(hours = 1), minute = minute))
+
+	def every(self, name, callback, seconds, at_start = False):
+		# run the job every n seconds
+		self._register(name, callback, at_start, lambda last: last + seconds)
+
+	def _register(self, name, callback, at_start, next_run):
+		# a job with 'at_start' runs with the first call of 'run_pending' if it did not run today
+		if at_start and name not in self.jobs and not _today(self.last_run.get(name)):
+			self.last_run.pop(name, None)
+		self.jobs[name] = {'callback': callback, 'next_run': next_run}
+
+	def _due(self, name):
+		# when the job is due next (wall clock), a job that never ran is due now
+		if name in self.retry_at:
+			return self.retry_at[name]
+		last = self.last_run.get(name)
+		if last is None:
+			return 0
+		return self.jobs[name]['next_run'](last)
+
+	def wait_seconds(self):
+		# the seconds until the next job is due
+		if not self.jobs:
+			return float('inf')
+		return max(0, min(self._due(name) for name in self.jobs) - time.time())
+
+	async def run_pending(self, **kwargs):
+		# run all jobs due, the keyword arguments like the current connections are handed over to each job
+		for name in list(self.jobs):
+			if self._due(name) <= time.time():
+				await self.run(name, **kwargs)
+
+	async def run(self, name, **kwargs):
+		# run the job now independent of when it is due
+		start = sol_metrics.now()
+		try:
+			result = await self.jobs[name]['callback'](**kwargs)
+		finally:
+			sol_metrics.record_since('job_' + name, start)
+		if result is False:
+			sol_utils.logging('Jobs: ' + name + ' failed, retrying in ' + str(sol_utils.merged_config['timer_live']) + 's.')
+			self.retry_at[name] = time.time() + sol_utils.merged_config['timer_live']
+			return
+		self.retry_at.pop(name, None)
+		self.last_run[name] = time.time()
+		self._save()
+
+	def _save(self):
+		state = sol_utils.load_state('jobs')
+		state[self.key] = self.last_run
+		sol_utils.save_state('jobs', state)
+
+def _today(last):
+	# true if the wall clock timestamp is from today (local time)
+	return last is not None and datetime.fromtimestamp(last).date() == datetime.now().date()
+
+def _next_time(last, step, **replace):
+	# the first point in time after last with the fields replaced, stepping by step
+	# last is a wall clock timestamp, the time is local time like configured for the scheduler
+	moment = datetime.fromtimestamp(last).replace(second = 0, microsecond = 0, **replace)
+	if moment.timestamp() <= last:
+		moment += step
+	return moment.timestamp()
@@ -2,35 +2,96 @@ import os
 import sys
 import json
 import time
-import schedule
+import functools
 from datetime import datetime
 import solmate_connect as sol_connect
 import solmate_env as sol_env
+import solmate_failover as sol_failover
+import solmate_jobs as sol_jobs
+import solmate_metrics as sol_metrics
+import solmate_polling as sol_polling
+import solmate_probe as sol_probe
+import solmate_reconnect as sol_reconnect
 import solmate_utils as sol_utils
 
 version = '7.3.0'
 
-def query_once_a_day(smws_conn, route, data, mqtt_conn, print_response, endpoint):
+# the mqtt endpoint the response of a route is published to
+# note the endpoint: it MUST match one defined in 'sol_ha_config.entities'
+route_endpoints = {
+	'live_values': 'live',
+	'get_injection_settings': 'get_injection',
+	'get_boost_injection': 'get_boost',
+	'get_solmate_info': 'info'
+}
+
+async def query_once_a_day(route, data, print_response, endpoint, smws_conn, mqtt_conn):
 	# send request but only when triggered by the scheduler
+	# the connections are handed over by the scheduler when running the job
 	# use only for requests with routes that change rarely, more requests can be added
+	# returns False if the query failed, the scheduler then retries it
 	sol_utils.logging('Main: Once a day queries called by scheduler.')
-	response = smws_conn.query_solmate(route, data)
-	if response != False:
-		if not 'timestamp' in response:
-			# fake a timestamp into the response if not present
-			response['timestamp'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-		if not 'operating_state' in response:
-			# fake an operating_state into the response if not present, the content will be added in mqtt.
-			response['operating_state'] = ''
-		if print_response:
-			sol_utils.print_request_response(route, response)
-		if mqtt_conn:
-			mqtt_conn.send_sensor_update_message(response, endpoint)
-
-def main(self = None):
+	response = await smws_conn.query_solmate(route, data)
+	if response == False:
+		return False
+	if not 'timestamp' in response:
+		# fake a timestamp into the response if not present
+		response['timestamp'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+	if not 'operating_state' in response:
+		# fake an operating_state into the response if not present, the content will be added in mqtt.
+		response['operating_state'] = ''
+	if print_response:
+		sol_utils.print_request_response(route, response)
+	# persisted, a restart the same day does not query it again but publishes the persisted one
+	save_info_response(response)
+	if mqtt_conn:
+		mqtt_conn.send_sensor_update_message(response, endpoint)
+
+def save_info_response(response):
+	# persist the response of 'get_solmate_info' per serial number
+	state = sol_utils.load_state('info')
+	state['info_' + str(sol_utils.merged_config['eet_serial_number'])] = dict(response)
+	sol_utils.save_state('info', state)
+
+def load_info_response():
+	# the persisted response of 'get_solmate_info' or none
+	return sol_utils.load_state('info').get('info_' + str(sol_utils.merged_config['eet_serial_number']))
+
+async def query_batch(smws_conn, requests, mqtt_conn, print_response):
+	# query all (route, data) requests of a poll cycle at once and publish the responses in one step
+	# a failing route is reported on its own and does not throw away the others.
+	# if a route failed because of a connection issue, this is raised after publishing the others
+	start = sol_metrics.now()
+	results = await smws_conn.query_many(requests)
+
+	updates = {}
+	failed = None
+	for route, response in results.items():
+		if isinstance(response, Exception):
+			# only the first error is raised, all others are consequential
+			failed = failed or response
+			continue
+		if response:
+			if print_response:
+				sol_utils.print_request_response(route, response)
+			updates[route_endpoints[route]] = response
+
+	if mqtt_conn and updates:
+		mqtt_conn.send_sensor_update_messages(updates)
+
+	sol_metrics.record_since('poll_batch', start)
+
+	if failed:
+		raise failed
+
+	return results
+
+async def main(self = None, env_file = None):
 	# the main routine that covers all. must be called by a higher layer doing final error catching
 	# the parameter self is optional. if not set, we have a default setup like with systemd
 	# if set, it comes from appdaemon and holds the class access
+	# the parameter env_file is optional and used in fleet mode, see solmate_fleet.py
+	# this is a coroutine, all connections and timers share the one event loop it runs on
 
 	# version is defined on the module level
 	global version
@@ -38,7 +99,7 @@ def main(self = None):
 	try:
 		# basic initialisation
 		# get envvars to configure access either from file or from os/docker envvars
-		sol_env.process_env(version, self)
+		sol_env.process_env(version, self, env_file)
 
 		print_response = sol_utils.merged_config['general_print_response']
 
@@ -55,9 +116,32 @@ def main(self = None):
 		mqtt_conn = None
 		eet_connected = False
 		mqtt_connected = False
-		job_scheduler = False
+		# scheduled jobs, in fleet mode each solmate has its own
+		jobs = sol_jobs.job_scheduler()
+		# get values from the 'get_solmate_info' route once a day
+		# this content changes rarely, most likely the version number from time to time.
+		# it also runs with the first connection to get a first response which mqtt needs,
+		# except it already ran today
+		jobs.daily(
+				'solmate_info',
+				functools.partial(
+					query_once_a_day,
+					route='get_solmate_info',
+					data={},
+					print_response=print_response,
+					endpoint='info'
+				),
+				at='23:45',
+				at_start=True
+			)
 		# necessary for very early failures during connecting which is before the while loop
 		reboot_triggered = False
+		# decides how long to wait before reconnecting after a failure
+		reconnect_policy = sol_reconnect.reconnect_policy()
+		# the standby path if configured
+		dual_path = sol_failover.dual_path()
+		# when each polled route is due
+		route_schedule = sol_polling.route_schedule()
 
 	except Exception as err:
 		# if the error happened before successfully getting the envvars in process_env
@@ -77,41 +161,44 @@ def main(self = None):
 			# the timer value in the error raised defines which timer to use
 			if not eet_connected:
 				# connect and authenticate, don't continue if this fails
-				smws_conn, online, local = sol_connect.connect_solmate()
+				smws_conn, online, local = await sol_connect.connect_solmate()
 
 				# some api's are only available depending on local or cloud connection
-				api_available = sol_connect.check_routes(smws_conn, local)
+				api_available = await sol_connect.check_routes(smws_conn, local)
 				eet_connected = True
+				await dual_path.primary_connected()
 
 			if not mqtt_connected:
 				# connect and authenticate to mqtt if defined
 				# mqtt_conn can either be false (mqtt not used) or contains the mqtt connection object
-				mqtt_conn = sol_connect.connect_mqtt(api_available)
+				mqtt_conn = await sol_connect.connect_mqtt(api_available)
 				# connected says, that technically the initialisation was successful
 				mqtt_connected = True
 
-			# get values from the 'get_solmate_info' route
-			# start a scheduler for once-a-day requests
-			# this content changes rarely, most likely the version number from time to time.
-			# the scheduler gets deleted if there is any connection issue and resetup.
-			schedule.every().day.at('23:45').do(
-					query_once_a_day,
-					smws_conn=smws_conn,
-					route='get_solmate_info',
-					data={},
-					mqtt_conn=mqtt_conn,
-					print_response=print_response,
-					endpoint='info'
-				)
+			if mqtt_conn:
+				# the available routes change if the websocket connection switched between local and cloud
+				mqtt_conn.update_api_available(api_available)
 
-			# run all already defined tasks in the scheduler to get a first response
-			# only necessary to run once even if one of the connections are resetup
-			if not job_scheduler:
-				schedule.run_all()
-				job_scheduler = True
+			# run the jobs due like the first 'get_solmate_info' or one missed while not connected
+			await jobs.run_pending(smws_conn=smws_conn, mqtt_conn=mqtt_conn)
+
+			if mqtt_conn and mqtt_conn.remember_info_response is None:
+				# the info job did not run with this mqtt connection, like after a restart the same day.
+				# mqtt needs an info response, publish the persisted one or query it if there is none
+				info_response = load_info_response()
+				if info_response:
+					mqtt_conn.send_sensor_update_message(info_response, 'info', True)
+				else:
+					await jobs.run('solmate_info', smws_conn=smws_conn, mqtt_conn=mqtt_conn)
 
 			reboot_triggered = False
 
+			# all connections are up, this also tells how long reconnecting took
+			reconnect_policy.connected()
+
+			# query all routes with the first poll cycle after (re)connecting
+			route_schedule.clear()
+
 			while True:
 			# loop to continuosly request live values or process commands from mqtt
 				route = None
@@ -132,13 +219,14 @@ def main(self = None):
 						# we could also add a shutdown button to shut down the solmate - not implemented so far
 						if route == 'shutdown' and value == 'reboot':
 							reboot_triggered = True
-							response = smws_conn.query_solmate('shutdown', {'shut_reboot': 'reboot'})
+							response = await smws_conn.query_solmate('shutdown', {'shut_reboot': 'reboot'})
 							# nothing will executed after a reboot command
 							# there will be websocket connection errors due to loss of the connection
 							# setting the mqtt operatring state to normal is done in the exception
 
 						# process all other queue elements
-						response = smws_conn.query_solmate(route, data)
+						start = sol_metrics.now()
+						response = await smws_conn.query_solmate(route, data)
 						if response:
 							if 'success' in response and not response['success']:
 							# success returned false {'success': False}
@@ -146,39 +234,37 @@ def main(self = None):
 								err = 'Main: Write back to Solmate failed: ' + str(route) + ' ' + str(data)
 								sol_utils.logging(err)
 								#print('\n')
+						# read back and publish the value written with this poll cycle
+						route_schedule.written(route, start)
 
-				# get values from the 'live_values' route
-				# we only expect solmate connection exceptions 
-				response = smws_conn.query_solmate('live_values', {})
-				if response:
-					if print_response:
-						sol_utils.print_request_response('live_values', response)
-					if mqtt_conn:
-						mqtt_conn.send_sensor_update_message(response, 'live')
-
-				# get values from the 'get_injection_settings' route if the route is available
+				# get values from the 'live_values', 'get_injection_settings' and 'get_boost_injection' routes
+				# the latter two only if the route is available. all routes due are queried in one batch
+				# we only expect solmate connection exceptions
+				requests = [('live_values', {})]
 				if api_available['hasUserSettings']:
-					response = smws_conn.query_solmate('get_injection_settings', {})
-					if response:
-						if print_response:
-							sol_utils.print_request_response('get_injection_settings', response)
-						if mqtt_conn:
-							mqtt_conn.send_sensor_update_message(response, 'get_injection')
-
-				# get values from the 'get_boost_injection' route if the route is available
+					requests.append(('get_injection_settings', {}))
 				if api_available['sun2plugHasBoostInjection']:
-					response = smws_conn.query_solmate('get_boost_injection', {})
-					if response:
-						if print_response:
-							sol_utils.print_request_response('get_boost_injection', response)
-						if mqtt_conn:
-							mqtt_conn.send_sensor_update_message(response, 'get_boost')
+					requests.append(('get_boost_injection', {}))
+				requests = route_schedule.due_requests(requests)
+				if requests:
+					results = await query_batch(smws_conn, requests, mqtt_conn, print_response)
+					route_schedule.polled(results)
 
 				# check if there is a pending job due like the 'get_solmate_info'
-				schedule.run_pending()
+				await jobs.run_pending(smws_conn=smws_conn, mqtt_conn=mqtt_conn)
+
+				# keep the standby path in dual path mode and move back to the primary path when possible
+				takeover = await dual_path.keep_standby()
+				if takeover:
+					await smws_conn.close()
+					smws_conn, online, local, api_available = takeover
+					break
+
+				# log collected metrics if configured and due
+				sol_metrics.log_metrics_if_due()
 
-				# wait for the next round (async, non blocking for any other running background processes)
-				sol_utils.timer_wait('timer_live')
+				# wait until the next route or job is due (async, non blocking for any other running background processes)
+				await sol_utils.timer_wait_seconds(min(route_schedule.wait_seconds(), jobs.wait_seconds()))
 
 		except Exception as err:
 			# error printing has been done in the solmate/mqtt class
@@ -187,7 +273,7 @@ def main(self = None):
 				# if there are 2 arguments in the raised error, we hope we have raised it
 				# then we can manually query the result for further processing
 				# err.args[0] is the source string returned
-				# err.args[1] is the timer string to be used
+				# err.args[1] is the failure reason, together with the source it defines the failure class
 				error_string = str(err.args[0])
 
 				if error_string not in ['websocket', 'mqtt']:
@@ -197,36 +283,46 @@ def main(self = None):
 					raise
 
 				# now we know we are handling own errors
-				timer_to_use = str(err.args[1])
+				failure = error_string + '_' + str(err.args[1])
 
-				if reboot_triggered:
-					# shutdown needs a special timer and not the one coming from the exception
-					# because that one is too short and we would finally end up in timer_offline
-					timer_to_use = 'timer_reboot'
+				if error_string == 'websocket':
+					# for safety, we remove the class object
+					if smws_conn:
+						await smws_conn.close()
+						smws_conn = None
+					eet_connected = False
 
-				seconds_to_wait = str(sol_utils.merged_config[timer_to_use])
-				print_string = ' - waiting ' + seconds_to_wait + 's' + ' and reconnect.'
+					if not reboot_triggered:
+						# in dual path mode, continue polling on the standby path without waiting
+						takeover = await dual_path.failover()
+						if takeover:
+							smws_conn, online, local, api_available = takeover
+							eet_connected = True
+							continue
+
+				if reboot_triggered:
+					# shutdown needs a special waiting time and not the one coming from the exception
+					# because that one is too short and we would finally end up in websocket_offline
+					failure = 'reboot'
+				else:
+					# check in parallel if the solmate and the mqtt server are reachable at all
+					# and let the result decide which backoff applies
+					reachable = await sol_probe.probe_targets(dual_path.active_uri())
+					failure = reconnect_policy.refine(failure, reachable)
+
+				seconds_to_wait = reconnect_policy.delay(failure)
+				print_string = ' - waiting ' + format(seconds_to_wait, '.1f') + 's' + ' and reconnect.'
 
-				# for safety, we remove the class object
 				# handle exceptions based on the source
 
 				if error_string == 'websocket':
-					if smws_conn:
-						smws_conn = None
-					eet_connected = False
-					# the scheduler needs to be reset because the connection object is no longer valid
-					schedule.clear()
 					sol_utils.logging('Main: Websocket: Connection error' + print_string)
-					# check if the solmate is reachable
-					host,port = sol_utils.strip_host_port(sol_utils.merged_config['eet_server_uri'])
-					if not sol_utils.isOpen(host, port):
-						sol_utils.logging('Main: No reply from Solmate: ' + str(host) + ':' + str(port))
 					# do not process any queue in the timer as long we reestablish the connection
 					# set optional argument false, defaults to true
 					# note that mqtt may be running but websocket is disconnected
 					# this handling is for safety because one could send data via HA to MQTT
 					# any open queue elements will be processed after reestablishing the connection !
-					sol_utils.timer_wait(timer_to_use, False)
+					await sol_utils.timer_wait_seconds(seconds_to_wait, False)
 					if reboot_triggered:
 						# we must come here because of the connection loss
 						# after the timer has ended, go back to normal in mqtt
@@ -239,12 +335,7 @@ def main(self = None):
 						mqtt_conn = None
 					mqtt_connected = False
 					sol_utils.logging('Main: MQTT: Connection error' + print_string)
-					# check if the mqtt server is reachable at all
-					host = sol_utils.strip_host_port(sol_utils.merged_config['mqtt_server'])
-					port = sol_utils.merged_config['mqtt_port']
-					if not sol_utils.isOpen(host, port):
-						sol_utils.logging('Main: No reply from MQTT server: ' + str(host) + ':' + str(port))
-					sol_utils.timer_wait(timer_to_use)
+					await sol_utils.timer_wait_seconds(seconds_to_wait)
 
 			else:
 				# the error was not one of the catched above and therefore not coverable
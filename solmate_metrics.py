@@ -0,0 +1,92 @@
+import time
+import solmate_utils as sol_utils
+
+# simple in-memory metrics to see where time is spent
+# a metric is identified by its name and collects count, min, max, average and last value
+# values are usually durations in seconds measured with the monotonic clock
+
+# histograms count the values of a metric per bucket, a bucket is defined by its upper bound in seconds
+# values above the last bound are counted in an extra bucket
+histogram_bounds = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+# in fleet mode, each solmate has its own metrics, they are kept with the device of the task
+# (or paho callback) recording them, see 'sol_utils.current_device'
+
+class metric_store:
+
+	def __init__(self):
+		self.metrics = {}					# name --> count, sum, min, max and last value
+		self.histograms = {}				# name --> count per bucket
+		self.last_logged = time.monotonic()	# when the metrics have been logged the last time
+
+def _store():
+	# the metrics of the current device
+	device = sol_utils.current_device.get()
+	if device.metrics is None:
+		device.metrics = metric_store()
+	return device.metrics
+
+def now():
+	# the clock used for all measurements, it is not affected by system time changes
+	return time.monotonic()
+
+def record(name, value):
+	# add a value to the named metric
+	m = _store().metrics.setdefault(name, {'count': 0, 'sum': 0.0, 'min': value, 'max': value, 'last': value})
+	m['count'] += 1
+	m['sum'] += value
+	m['min'] = min(m['min'], value)
+	m['max'] = max(m['max'], value)
+	m['last'] = value
+
+def record_histogram(name, value):
+	# add a value to the named metric and count it in the bucket it falls into
+	record(name, value)
+	h = _store().histograms.setdefault(name, [0] * (len(histogram_bounds) + 1))
+	for i, bound in enumerate(histogram_bounds):
+		if value <= bound:
+			h[i] += 1
+			return
+	h[-1] += 1
+
+def record_since(name, start):
+	# add the time passed since start to the named metric and return it
+	duration = now() - start
+	record(name, duration)
+	return duration
+
+def summary(name):
+	# return a printable summary of the named metric
+	m = _store().metrics.get(name)
+	if not m:
+		return name + ': no data'
+	return (name
+		+ ': count=' + str(m['count'])
+		+ ' avg=' + format(m['sum'] / m['count'], '.3f')
+		+ ' min=' + format(m['min'], '.3f')
+		+ ' max=' + format(m['max'], '.3f')
+		+ ' last=' + format(m['last'], '.3f'))
+
+def histogram_summary(name):
+	# return a printable summary of the buckets of the named histogram that have values
+	h = _store().histograms.get(name)
+	if not h:
+		return name + ': no data'
+	labels = ['<=' + str(bound) for bound in histogram_bounds] + ['>' + str(histogram_bounds[-1])]
+	return name + ': ' + ' '.join(label + ':' + str(count) for label, count in zip(labels, h) if count)
+
+def log_metrics():
+	# log a summary line for each metric
+	store = _store()
+	for name in sorted(store.metrics):
+		sol_utils.logging('Metrics: ' + summary(name))
+		if name in store.histograms:
+			sol_utils.logging('Metrics: ' + histogram_summary(name))
+
+def log_metrics_if_due():
+	# log the metrics every 'timer_metrics' seconds, 0 disables logging
+	store = _store()
+	interval = sol_utils.merged_config['timer_metrics']
+	if interval and now() - store.last_logged >= interval:
+		store.last_logged = now()
+		log_metrics()
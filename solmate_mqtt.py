@@ -1,9 +1,13 @@
-import json
+import asyncio
+import hashlib
 import os
 import sys
 import time
 import signal
+import threading
+import solmate_codec as sol_codec
 import solmate_ha_config as sol_ha_config
+import solmate_probe as sol_probe
 import solmate_utils as sol_utils
 
 # following code is executed on module load
@@ -60,12 +64,15 @@ class solmate_mqtt():
 		self.remember_info_response = None
 		self.remember_get_boost_response = None
 		self.remember_get_injection_response = None
-		self.real_names = None
-		self.fake_names = None
-		self.routes = None
-		self.configs = None
+		self.registry = None		# the entities with their configs, see solmate_ha_config.py
 		self.has_ha_config = False
 		self.first_query_has_run = False
+		# endpoint --> (payload, time) last published, see '_is_due'
+		self.last_published = {}
+		self.loop = None
+		self.connection = None
+		# the device (config and queue) this object belongs to, needed in paho callbacks
+		self.device = sol_utils.current_device.get()
 
 		sol_utils.logging('MQTT: Initializing the class')
 
@@ -96,11 +103,41 @@ class solmate_mqtt():
 		self.mqtt_availability_topic = self.mqtt_prefix + '/sensor/' + self.mqtt_topic + '/availability'
 		self.mqtt_never_available_topic = self.mqtt_prefix + '/sensor/' + self.mqtt_topic + '/never_available'
 
+		# HA publishes 'online' when it (re)starts, the birth message
+		# https://www.home-assistant.io/integrations/mqtt/#birth-and-last-will-messages
+		self.mqtt_ha_status_topic = self.mqtt_ha + '/status'
+
+		# publish one device config for all entities instead of one config per entity
+		self.ha_device_discovery = sol_utils.merged_config['general_ha_device_discovery']
+
+		# in fleet mode, the connection is shared and its last will can only cover one topic.
+		# all entities then depend on the availability of the bridge topic too
+		self.mqtt_bridge_topic = self.mqtt_prefix + '/esham/availability' if self.device.name else None
+
 		# MQTT qos values (http://www.steves-internet-guide.com/understanding-mqtt-qos-levels-part-1/)
 		# QOS 0 – Once (not guaranteed)
 		# QOS 1 – At Least Once (guaranteed)
 		# QOS 2 – Only Once (guaranteed)
-		self.mqtt_qos = 2
+		# the qos is defined per class of topic with 'mqtt_qos_<class>', all default to 2
+		#	config:			the HA discovery configs
+		#	availability:	the availability topics including the last will
+		#	state:			the states published every poll cycle
+		#	command:		the command topics HA writes to and which are subscribed
+		self.mqtt_qos_config = _qos('mqtt_qos_config')
+		self.mqtt_qos_availability = _qos('mqtt_qos_availability')
+		self.mqtt_qos_state = _qos('mqtt_qos_state')
+		self.mqtt_qos_command = _qos('mqtt_qos_command')
+
+		# states can expire on the broker after 'timer_state_expiry' seconds (MQTT 5), 0 = never
+		# an expired retained state is no longer delivered, like to HA restarting while esham is down
+		self.state_properties = None
+		if sol_utils.merged_config['timer_state_expiry']:
+			self.state_properties = mqtt.Properties(PacketTypes.PUBLISH)
+			self.state_properties.MessageExpiryInterval = sol_utils.merged_config['timer_state_expiry']
+
+		# states are only published if a field changed by more than its deadband 'mqtt_deadband_<field>'
+		# or if the last publish is 'timer_heartbeat' seconds ago
+		self.deadbands = {k[len('mqtt_deadband_'):]: _to_float(v) for k, v in sol_utils.merged_config.items() if k.startswith('mqtt_deadband_')}
 
 	def signal_handler_sigint(self, signum, frame):
 		# catch sigint (ctrl-c) and process a graceful shutdown
@@ -112,54 +149,19 @@ class solmate_mqtt():
 		self.signal_reason = 2
 		self.graceful_shutdown()
 
-	def init_mqtt_client(self):
+	async def init_mqtt_client(self):
 		try:
 			# initialize the MQTT client. to see if it was successful, you must go to _on_connect
 			sol_utils.logging('MQTT: Initializing the client')
 
-			# protocol versions available
-			# MQTTv31  = 3
-			# MQTTv311 = 4
-			# MQTTv5   = 5
+			# the event loop of the main program, paho callbacks use it to run coroutines
+			self.loop = asyncio.get_running_loop()
 
-			self.mqttclient = mqtt.Client(
-				mqtt.CallbackAPIVersion.VERSION2,
-				protocol = mqtt.MQTTv5,
-				client_id = self.mqtt_client_id
-			)
-			self.mqttclient.on_connect = self._on_connect
-			self.mqttclient.on_disconnect = self._on_disconnect
-
-			#self.mqttclient.on_publish = self._on_publish	  # uncomment for testing purposes
-			self.mqttclient.on_message = self._on_message
-			self.mqttclient.username_pw_set(
-				self.mqtt_username,
-				self.mqtt_password
-			)
-			self.mqttclient.will_set(
-				self.mqtt_availability_topic,
-				payload = 'offline',
-				qos = 0,
-				retain = True
-			)
-
-			# to make the code work with both MQTTv5 and MQTTv3.1.1 we need to set the properties object to None
-			# server/port issues are handled here
-			self.mqttclient.connect(
-				self.mqtt_server,
-				port = self.mqtt_port,
-				# http://www.steves-internet-guide.com/mqtt-keep-alive-by-example/
-				# no need to set this value with paho-mqtt
-				# this avoids on the broker the following message pairs beling logged
-				# "Client solmate_mqtt closed its connection.
-				# "Client xyz closed its connection.
-				#keepalive = 70,
-				bind_address = '',
-				bind_port = 0,
-				clean_start = mqtt.MQTT_CLEAN_START_FIRST_ONLY,
-				properties = None
-			)
-			self.mqttclient.loop_start()
+			# the connection to the broker, in fleet mode it is shared with other solmates
+			# paho callbacks are handed over from the connection to this object
+			self.connection = _get_connection(self)
+			self.mqttclient = self.connection.client
+			self.connection.attach(self)
 
 			#sol_utils.logging('MQTT: Connection failed: ' + str(err))
 			#sys.exit()
@@ -167,7 +169,8 @@ class solmate_mqtt():
 			# wait until on_connect returns a response
 			while self.connect_ok == None:
 				# wait until the connection is either established or failed (like user/pwd typo)
-				time.sleep(1)
+				# the wait must not block the event loop, the websocket keepalive runs on it
+				await asyncio.sleep(1)
 
 			if not self.connect_ok:
 				# when we fail connecting during initialisation, we have an auth error
@@ -176,45 +179,157 @@ class solmate_mqtt():
 		except Exception as err:
 			# print any error that has occured
 			sol_utils.logging(str(err))
-			raise Exception('mqtt', 'timer_offline')
+			raise Exception('mqtt', 'offline')
 
 		# update HA topics to initialise correctly
-		sol_utils.logging('MQTT: Update topics for Homeassistant')
-
-		# update the home assistant auto config info
-		# each item needs its own publish
-		self.fake_names, self.real_names, self.routes, names, self.configs, config_topics = sol_ha_config.construct_ha_config_message(self)
-
-		for i in range(0,len(self.fake_names)):
-			#print(self.fake_names[i])
-			#print(self.real_names[i])
-			#print(self.routes[i])
-			#print(names[i])
-			#print(self.configs[i])
-			#print(config_topics[i])
-			self.mqttclient.publish(
-				config_topics[i] + names[i] + '/config',
-				payload = self.configs[i],
-				qos = self.mqtt_qos,
-				retain = True,
-				properties = None
-			)
+		# the configs are published at once, then all acknowledgements are awaited
+		await self._wait_published(self._publish_ha_config())
 
-		self.has_ha_config = True
 		# lets do a correct subscription with all available command topics
 		self._do_mqtt_subscriptions()
 
 		# init the button to make it show up
 		self._init_button_command_topic('reboot', '')
 
+	def _publish_ha_config(self, force = False):
+		# publish the home assistant auto config info
+		# HA re-processes every config published, therefore only configs that changed are published.
+		# a hash of each config published is persisted per broker and topic, see 'sol_utils.save_state'.
+		# force publishes all, like when HA restarted. returns the results of the publishes
+		key = self._ha_config_key()
+		state = sol_utils.load_state('ha_config')
+		hashes = {} if force else state.get(key, {})
+
+		# update the home assistant auto config info
+		# the registry resolves the entities for this solmate, see solmate_ha_config.py
+		# each item needs its own publish, except with device discovery which is one for all
+		self.registry = sol_ha_config.compile_registry(self)
+		if self.ha_device_discovery:
+			configs = [(self.registry.device_topic, self.registry.device_payload)]
+		else:
+			configs = [(e.config_topic, e.payload) for e in self.registry.entities]
+
+		# topics published formerly that are no longer used, like when switching the discovery mode.
+		# the discovery mode is persisted too, versions before did not persist it but only had the entity mode.
+		# without the hashes, the topics of the former mode are taken from the registry if the mode changed.
+		# without a 'general_state_folder' nothing is known about former publishes and nothing is migrated
+		mode = 'device' if self.ha_device_discovery else 'entity'
+		mode_key = key + '_mode'
+		current = set(topic for topic, payload in configs)
+		if key in state:
+			stale = [topic for topic in state[key] if topic not in current]
+		elif sol_utils.merged_config['general_state_folder'] and state.get(mode_key, 'entity') != mode:
+			stale = [e.config_topic for e in self.registry.entities] if self.ha_device_discovery else [self.registry.device_topic]
+		else:
+			stale = []
+
+		# when switching the discovery mode, HA keeps the entities if told to migrate them first
+		# https://www.home-assistant.io/integrations/mqtt/#migration-from-single-component-to-device-based-discovery
+		results = []
+		if stale:
+			sol_utils.logging('MQTT: Migrate ' + str(len(stale)) + ' former topics for Homeassistant')
+		for topic in stale:
+			results.append(self._publish_config(topic, sol_codec.dumps({'migrate_discovery': True})))
+
+		changed = 0
+		for topic, payload in configs:
+			#print(topic)
+			#print(payload)
+			digest = hashlib.sha256(payload).hexdigest()
+			if hashes.get(topic) == digest:
+				continue
+			results.append(self._publish_config(topic, payload))
+			hashes[topic] = digest
+			changed += 1
+
+		# then remove the retained former configs
+		for topic in stale:
+			results.append(self._publish_config(topic, ''))
+			hashes.pop(topic, None)
+
+		sol_utils.logging('MQTT: Update topics for Homeassistant: ' + str(changed) + ' of ' + str(len(configs)) + ' changed')
+		if results or state.get(mode_key) != mode:
+			state[key] = hashes
+			state[mode_key] = mode
+			sol_utils.save_state('ha_config', state)
+
+		self.has_ha_config = True
+		return results
+
+	def _publish_config(self, topic, payload):
+		# publish a retained HA config, an empty payload removes it
+		return self.mqttclient.publish(
+			topic,
+			payload = payload,
+			qos = self.mqtt_qos_config,
+			retain = True,
+			properties = None
+		)
+
+	def _ha_config_key(self):
+		# the configs are retained per broker and topic
+		return self.mqtt_server + ':' + str(self.mqtt_port) + '_' + self.mqtt_topic
+
+	async def _wait_published(self, results):
+		# wait until all publishes are acknowledged by the broker, max 4 sec
+		# if not, the hashes are dropped to publish all configs with the next connect
+		# paho signals each acknowledgement, waiting for it blocks and is done in a worker thread
+		if not results:
+			return
+		loop = asyncio.get_running_loop()
+		if await loop.run_in_executor(None, _wait_for_publish, results, 4):
+			return
+		sol_utils.logging('MQTT: Not all topics for Homeassistant were acknowledged.')
+		state = sol_utils.load_state('ha_config')
+		state.pop(self._ha_config_key(), None)
+		sol_utils.save_state('ha_config', state)
+
+	def _on_ha_status(self, message):
+		# HA (re)started, it may have lost the configs, publish them all
+		# a retained birth message is ignored, else every connect would publish all configs
+		if message.retain or message.payload.decode('utf-8') != 'online':
+			return
+		sol_utils.logging('MQTT: Homeassistant is online.')
+		# this callback runs in the paho network thread which must not be blocked and is shared in fleet mode.
+		# the configs are published by the event loop, like all other publishes of the configs
+		if self.loop:
+			try:
+				self.loop.call_soon_threadsafe(self._republish_ha_config)
+			except RuntimeError:
+				# the event loop is closed, the configs are published with the next connect
+				pass
+
+	def _republish_ha_config(self):
+		# publish all configs after HA (re)started, runs on the event loop
+		try:
+			self._publish_ha_config(True)
+		except Exception as err:
+			# the connection is handled by the next poll cycle, HA gets the configs with the next connect
+			sol_utils.logging('MQTT: Could not publish the topics for Homeassistant: ' + str(err))
+
+	def update_api_available(self, api_available):
+		# the available api routes changed like when the connection switched between local and cloud
+		# the availability of entities is part of the HA config, republish it if anything changed
+		if api_available == self.api_available:
+			return
+
+		self.api_available = api_available
+		try:
+			self._publish_ha_config()
+			if self.remember_info_response:
+				# connected_to is part of the info response
+				self.send_sensor_update_message(self.remember_info_response, 'info', True)
+		except Exception:
+			raise Exception('mqtt', 'conn_err')
+
 	def _init_button_command_topic(self, command, payload):
 		# update the system command topic
 		#print(command)
 		#print(payload)
 		self.mqttclient.publish(
 			self.mqtt_button_topic + '/command/' + command,
-			payload = json.dumps(payload),
-			qos = self.mqtt_qos,
+			payload = sol_codec.dumps(payload),
+			qos = self.mqtt_qos_command,
 			retain = True,
 			properties = None
 		)
@@ -226,15 +341,22 @@ class solmate_mqtt():
 		# triggered by _on_connect and init_mqtt_client
 		# on_connect will trigger before ha_config has run, we need to cover this 
 		if self.has_ha_config == True:
-			for i in range(0,len(self.fake_names)):
-				if 'command_topic' in self.configs[i]:
-					y = json.loads(self.configs[i])
-					command_topic = y['command_topic']
-					self.mqttclient.subscribe(
-						command_topic,
-						options = None,
-						properties = None
-					)
+			self.mqttclient.subscribe(
+				self.mqtt_ha_status_topic,
+				qos = self.mqtt_qos_availability,
+				options = None,
+				properties = None
+			)
+			# one subscription per tree of command topics, the registry knows the topics
+			for tree in (self.mqtt_number_topic, self.mqtt_button_topic + '/command'):
+				# messages on the topics of the tree are handed over to this object
+				self.connection.topics[tree] = self
+				self.mqttclient.subscribe(
+					tree + '/+',
+					qos = self.mqtt_qos_command,
+					options = None,
+					properties = None
+				)
 
 	def graceful_shutdown(self):
 		# the 'will_set' is not sent on graceful shutdown by design
@@ -246,19 +368,25 @@ class solmate_mqtt():
 				publish_result = self.mqttclient.publish(
 					self.mqtt_availability_topic,
 					payload = 'offline',
-					qos = self.mqtt_qos,
+					qos = self.mqtt_qos_availability,
 					retain = True,
 					properties = None
 				)
 				# max wait 4 sec to get the message published.
 				# there can be cases where this would run forever
 				publish_result.wait_for_publish(4) 
-				self.mqttclient.disconnect()
-				self.mqttclient.loop_stop()
 			except Exception:
 				pass
+			# the connection is only closed if no other solmate uses it
+			self.connection.detach(self)
 
 			self.connect_ok = False
+
+			if self.signal_reason:
+				# the whole program terminates, shut down all other solmates in fleet mode too
+				for connection in list(connections.values()):
+					for mqtt_conn in list(connection.devices):
+						connection.dispatch(mqtt_conn, mqtt_conn.graceful_shutdown)
 			# 0 ... self.signal_reason defaults to 0, means no signal was used
 			# 1 ... sigint (ctrl-c)
 			# 2 ... sigterm (sudo systemctl stop eet.solmate.service)
@@ -277,13 +405,13 @@ class solmate_mqtt():
 			client.publish(
 				self.mqtt_availability_topic,
 				payload = 'online',
-				qos = self.mqtt_qos,
+				qos = self.mqtt_qos_availability,
 				retain = True
 			)
 			client.publish(
 				self.mqtt_never_available_topic,
 				payload = 'offline',
-				qos = self.mqtt_qos,
+				qos = self.mqtt_qos_availability,
 				retain = True
 			)
 			self.connect_ok = True
@@ -294,6 +422,9 @@ class solmate_mqtt():
 			# will also trigger on disconnect and reconnect
 			self._do_mqtt_subscriptions()
 
+			# the broker may have lost the retained states, publish all states with the next poll cycle
+			self.last_published.clear()
+
 			if self.first_query_has_run:
 				# there was a disconnect and we have info values that are remembered
 				# now thre is was a reconnect, update the values for HA
@@ -324,10 +455,10 @@ class solmate_mqtt():
 				+ str(PacketTypes.Names[reason_code.packetType])
 				)
 			# check if the mqtt server is reachable at all
-			host,port = sol_utils.strip_host_port(sol_utils.merged_config['mqtt_server'])
-			port = sol_utils.merged_config['mqtt_port']
-			if not sol_utils.isOpen(host, port):
-				sol_utils.logging('Main: No reply from MQTT server: ' + str(host) + ':' + str(port))
+			# this callback runs in the paho network thread which must not be blocked,
+			# the probe is therefore handed over to the event loop of the main program
+			if self.loop:
+				asyncio.run_coroutine_threadsafe(sol_probe.probe_mqtt(), self.loop)
 
 	def _on_publish(self, client, userdata, message, reason_codes, properties = None):
 		print(f'MQTT messages published: {message}')
@@ -365,8 +496,12 @@ class solmate_mqtt():
 
 		if value:
 			# only proceed if there is a value, empty is not valid
+			entity = self.registry.by_command.get(topic)
+			if entity is None:
+				return
+
 			# reboot needs special treatment
-			if topic.endswith('command/reboot'):
+			if entity.fake_name == 'reboot':
 				# if triggered, the value coming from HA is 'doit'
 				self._manage_reboot(value)
 				return
@@ -375,68 +510,35 @@ class solmate_mqtt():
 			# IMPORTANT: values are casted if possible to integer
 			# check results from the solmate API if a route has a string = special treatment
 
+			# the remembered response of the endpoint holds the current values
+			remember = getattr(self, 'remember_' + entity.endpoint + '_response')
 			write_dict = {}
-			boost_dict = {}
-			boost = False
-			matches = ["set_wattage", "set_time"]
 
 			# 'set_boost_injection' needs special treatment, we need to send time and wattage together!
-			# we can only distinguish via the unique topic
 			# get the former values where one will get updated in the next step
-			if any(x in topic for x in matches):
-				for i in range(0,len(self.routes)):
-					# a route can have a real route or false meaning no route present
-					if self.routes[i]:
-					# loop thru all routes and check if we have 'set_boost_injection' route
-						if 'set_boost_injection' in self.routes[i]:
-							#print(i, self.routes[i], self.fake_names[i])
-							write_dict[self.real_names[i]] = self.remember_get_boost_response[self.fake_names[i]]
-							boost = True
-					#print(write_dict)
-			#sys.exit()
-
-			# now process the changes normally
-			for i in range(0,len(self.fake_names)):
-				if topic in self.configs[i]:
-					#print(self.fake_names[i])
-					#print(self.real_names[i])
-					#print(self.routes[i])
-					#print(self.configs[i])
-					if boost:
-						# only if boost has formerly been identified
-						# update the changed key in the dictionary (two items are present)
-						write_dict[self.real_names[i]] = self._check_value(
-							self.fake_names[i],
-							self.remember_get_boost_response,
-							self.configs[i],
-							value, topic)
-						#print(self.routes[i], write_dict)
-						sol_utils.mqtt_queue.put((self.routes[i], write_dict))
-					else:
-					# all others can be processed normally
-						write_dict[self.real_names[i]] = self._check_value(
-							self.fake_names[i],
-							self.remember_get_injection_response,
-							self.configs[i],
-							value,topic)
-						#print(self.routes[i], write_dict)
-						sol_utils.mqtt_queue.put((self.routes[i], write_dict))
-					break
-
-	def _check_value(self, key, remember, config, value, topic):
+			if entity.route == 'set_boost_injection':
+				for e in self.registry.by_route['set_boost_injection']:
+					write_dict[e.real_name] = remember[e.fake_name]
+				# a pair not sent yet replaces the former values, else it would be reverted when merged
+				write_dict.update(sol_utils.mqtt_queue.pending_data('set_boost_injection'))
+
+			# update the changed key in the dictionary
+			write_dict[entity.real_name] = self._check_value(entity, remember, value)
+			#print(entity.route, write_dict)
+			sol_utils.mqtt_queue.put((entity.route, write_dict))
+
+	def _check_value(self, entity, remember, value):
 		# check if we can cast the given value to integer
 		# this can cause problems if we try to send a string from
 		# locale 1 and convert it to interger with locale 2
 		# in addition we check if values are in range (same as we do in solmate_env)
 
-		c = json.loads(config)
-		name = c['name']
-		min_v = c['min']
-		max_v = c['max']
+		key = entity.fake_name
+		min_v = entity.config['min']
+		max_v = entity.config['max']
 		former = remember[key]
 
 		#print(remember)
-		#print(config)
 
 		try:
 			# convert and check if the values are in range
@@ -448,25 +550,22 @@ class solmate_mqtt():
 				return former
 
 			# only if we have min/max injection
-			matches = ['user_minimum_injection', 'user_maximum_injection']
-			if any(z in topic for z in matches):
-
-				min_e = remember['user_minimum_injection']
-				max_e = remember['user_maximum_injection']
-
-				# next test, check if x > max_existing, it must be lower
-				if 'user_minimum_injection' in topic:
-					if x > max_e:
-						#print('min', x, max_e)
-						sol_utils.logging("Key " + "'" + str(key) + "': " + str(x) + " value bigger than: " + str(max_e) + " using last valid: " + str(former))
-						return former
-
-				# next test, check if x < min_existing, it must be higher
-				if 'user_maximum_injection' in topic:
-					if x < min_e:
-						#print('max', x, min_v)
-						sol_utils.logging("Key " + "'" + str(key) + "': " + str(x) + " value lower than: " + str(min_e) + " using last valid: " + str(former))
-						return former
+			min_e = remember.get('user_minimum_injection')
+			max_e = remember.get('user_maximum_injection')
+
+			# next test, check if x > max_existing, it must be lower
+			if key == 'user_minimum_injection':
+				if x > max_e:
+					#print('min', x, max_e)
+					sol_utils.logging("Key " + "'" + str(key) + "': " + str(x) + " value bigger than: " + str(max_e) + " using last valid: " + str(former))
+					return former
+
+			# next test, check if x < min_existing, it must be higher
+			if key == 'user_maximum_injection':
+				if x < min_e:
+					#print('max', x, min_v)
+					sol_utils.logging("Key " + "'" + str(key) + "': " + str(x) + " value lower than: " + str(min_e) + " using last valid: " + str(former))
+					return former
 			#print(x)
 			return x
 
@@ -498,9 +597,10 @@ class solmate_mqtt():
 			sol_utils.mqtt_queue.put(('shutdown', {'shut_reboot': 'reboot'}))
 			sol_utils.logging('Initializing SolMate Reboot.')
 
-	def send_sensor_update_message(self, response, endpoint):
+	def send_sensor_update_message(self, response, endpoint, force = False):
 		# after connecting and initializing, this is the only location where we expect an error
 		# that leads to the need re-initializing mqtt
+		# unless forced, the state is only published if it changed, see '_is_due'
 		try:
 			# send a mqtt update message, the format is fixed
 			# remember some settings necessary for other tasks
@@ -523,17 +623,19 @@ class solmate_mqtt():
 				# remember the last response
 				self.remember_get_injection_response = response
 
-			# note the endpoint: it MUST match one defined in 'sol_ha_config.construct_ha_config_message'
-			# the endpoint groups entities together so they can be updated at once
-			# the sort order is not relevant
-			update = self._construct_update_message(response)
-			self.mqttclient.publish(
-				self.mqtt_sensor_topic + '/' + endpoint,
-				payload = update,
-				qos = self.mqtt_qos,
-				retain = True,
-				properties = None
-			)
+			if force or self._is_due(response, endpoint):
+				# note the endpoint: it MUST match one defined in 'sol_ha_config.entities'
+				# the endpoint groups entities together so they can be updated at once
+				# the sort order is not relevant
+				update = self._construct_update_message(response)
+				self.mqttclient.publish(
+					self.mqtt_sensor_topic + '/' + endpoint,
+					payload = update,
+					qos = self.mqtt_qos_state,
+					retain = True,
+					properties = self.state_properties
+				)
+				self.last_published[endpoint] = (dict(response), time.monotonic())
 
 			# we now have passed at minimum the first query/update run
 			# this is necessary to populate the remember.xxx dictionaries
@@ -541,7 +643,32 @@ class solmate_mqtt():
 			self.first_query_has_run = True
 		except:
 			self.graceful_shutdown()
-			raise Exception('mqtt', 'timer_conn_err')
+			raise Exception('mqtt', 'conn_err')
+
+	def send_sensor_update_messages(self, updates):
+		# publish the responses of one poll cycle in one step
+		# updates is a dictionary with the endpoint as key and the response as value
+		for endpoint, response in updates.items():
+			self.send_sensor_update_message(response, endpoint)
+
+	def _is_due(self, response, endpoint):
+		# a state is due to be published if any field changed by more than its deadband (default 0)
+		# compared to the last published one, or if the last publish is 'timer_heartbeat' seconds ago
+		# the timestamp is not compared as it changes with every response
+		# one lookup only, a reconnect clears 'last_published' from the paho thread at any time
+		entry = self.last_published.get(endpoint)
+		if entry is None:
+			return True
+		last, published = entry
+		heartbeat = sol_utils.merged_config['timer_heartbeat']
+		if heartbeat and time.monotonic() - published >= heartbeat:
+			return True
+		for field in response.keys() | last.keys():
+			if field == 'timestamp':
+				continue
+			if _changed(last.get(field), response.get(field), self.deadbands.get(field, 0)):
+				return True
+		return False
 
 	def set_operating_state_normal(self):
 		# do the cleanup after successful rebooting
@@ -555,6 +682,186 @@ class solmate_mqtt():
 		# construct an update message
 		# note that whatever keys in the response are present, they are processed
 		# we need to replace real keys from the API with fake keys defined in the construct message
-		final = json.dumps(response)
+		final = sol_codec.dumps(response)
 		#print(json.dumps(response, indent=4))
 		return final
+
+def _qos(key):
+	# config values are strings, an invalid qos is logged and replaced by the default
+	try:
+		qos = int(sol_utils.merged_config[key])
+		if qos in (0, 1, 2):
+			return qos
+	except (TypeError, ValueError):
+		pass
+	sol_utils.logging('MQTT: Invalid ' + key + ': ' + str(sol_utils.merged_config[key]) + ', using 2.')
+	return 2
+
+def _wait_for_publish(results, timeout):
+	# block until all publishes are acknowledged or the timeout in seconds passed, runs in a worker thread
+	# returns true if all were acknowledged
+	end = time.monotonic() + timeout
+	try:
+		for result in results:
+			remaining = end - time.monotonic()
+			if remaining <= 0:
+				break
+			result.wait_for_publish(remaining)
+	except (ValueError, RuntimeError):
+		# the message was not queued or publishing failed like when disconnected
+		return False
+	return all(result.is_published() for result in results)
+
+def _to_float(value):
+	# config values are strings, an invalid deadband is logged and ignored
+	try:
+		return abs(float(value))
+	except (TypeError, ValueError):
+		sol_utils.logging('MQTT: Invalid deadband: ' + str(value) + ', ignored.')
+		return 0
+
+def _changed(old, new, deadband):
+	# numbers changed if they differ by more than the deadband, anything else if not equal
+	numbers = (int, float)
+	if isinstance(old, numbers) and isinstance(new, numbers) and not isinstance(old, bool) and not isinstance(new, bool):
+		return abs(new - old) > deadband
+	return old != new
+
+# mqtt connections by broker, in fleet mode all solmates using the same broker share one connection
+connections = {}
+
+def _get_connection(mqtt_conn):
+	# get the connection to the broker configured or create it
+	key = (mqtt_conn.mqtt_server, mqtt_conn.mqtt_port, mqtt_conn.mqtt_username)
+	if key not in connections:
+		connections[key] = mqtt_connection(key, mqtt_conn)
+	return connections[key]
+
+class mqtt_connection():
+	# one paho client with its network thread, used by one or more solmate_mqtt objects.
+	# paho callbacks are handed over to the object they belong to and run with its device
+
+	def __init__(self, key, mqtt_conn):
+		self.key = key
+		self.devices = []				# the solmate_mqtt objects using the connection
+		self.topics = {}				# subscribed tree of command topics --> solmate_mqtt object
+		self.connect_ok = None
+		self.lock = threading.Lock()	# attaching happens in the main, connecting in the paho thread
+		self.mqtt_qos = mqtt_conn.mqtt_qos_availability
+		self.will_topic = mqtt_conn.mqtt_bridge_topic or mqtt_conn.mqtt_availability_topic
+		self.bridge_topic = mqtt_conn.mqtt_bridge_topic
+
+		# protocol versions available
+		# MQTTv31  = 3
+		# MQTTv311 = 4
+		# MQTTv5   = 5
+
+		self.client = mqtt.Client(
+			mqtt.CallbackAPIVersion.VERSION2,
+			protocol = mqtt.MQTTv5,
+			client_id = mqtt_conn.mqtt_client_id
+		)
+		self.client.on_connect = self._on_connect
+		self.client.on_disconnect = self._on_disconnect
+
+		#self.client.on_publish = self._on_publish	  # uncomment for testing purposes
+		self.client.on_message = self._on_message
+		self.client.username_pw_set(
+			mqtt_conn.mqtt_username,
+			mqtt_conn.mqtt_password
+		)
+		self.client.will_set(
+			self.will_topic,
+			payload = 'offline',
+			qos = self.mqtt_qos,
+			retain = True
+		)
+
+		# the maximum number of qos 1 and 2 messages that can be in the process of being sent at once
+		if sol_utils.merged_config['mqtt_max_inflight']:
+			self.client.max_inflight_messages_set(int(sol_utils.merged_config['mqtt_max_inflight']))
+
+		# to make the code work with both MQTTv5 and MQTTv3.1.1 we need to set the properties object to None
+		# server/port issues are handled here
+		self.client.connect(
+			mqtt_conn.mqtt_server,
+			port = mqtt_conn.mqtt_port,
+			# http://www.steves-internet-guide.com/mqtt-keep-alive-by-example/
+			# no need to set this value with paho-mqtt
+			# this avoids on the broker the following message pairs beling logged
+			# "Client solmate_mqtt closed its connection.
+			# "Client xyz closed its connection.
+			#keepalive = 70,
+			bind_address = '',
+			bind_port = 0,
+			clean_start = mqtt.MQTT_CLEAN_START_FIRST_ONLY,
+			properties = None
+		)
+		self.client.loop_start()
+
+	def dispatch(self, mqtt_conn, callback, *args):
+		# run the callback with the device of the solmate_mqtt object
+		token = sol_utils.current_device.set(mqtt_conn.device)
+		try:
+			return callback(*args)
+		finally:
+			sol_utils.current_device.reset(token)
+
+	def attach(self, mqtt_conn):
+		# add a solmate_mqtt object, if the connection is already up, tell it
+		with self.lock:
+			self.devices.append(mqtt_conn)
+			if self.connect_ok:
+				mqtt_conn._on_connect(self.client, None, None, 0)
+
+	def detach(self, mqtt_conn):
+		# remove a solmate_mqtt object, the last one closes the connection
+		with self.lock:
+			if mqtt_conn in self.devices:
+				self.devices.remove(mqtt_conn)
+			for topic in [t for t, m in self.topics.items() if m is mqtt_conn]:
+				del self.topics[topic]
+			if self.devices:
+				return
+			connections.pop(self.key, None)
+
+		try:
+			if self.bridge_topic:
+				publish_result = self.client.publish(
+					self.bridge_topic,
+					payload = 'offline',
+					qos = self.mqtt_qos,
+					retain = True
+				)
+				publish_result.wait_for_publish(4)
+			self.client.disconnect()
+			self.client.loop_stop()
+		except Exception:
+			pass
+
+	def _on_connect(self, client, userdata, flags, reason_code, properties = None):
+		with self.lock:
+			self.connect_ok = (reason_code == 0)
+			if self.connect_ok and self.bridge_topic:
+				client.publish(
+					self.bridge_topic,
+					payload = 'online',
+					qos = self.mqtt_qos,
+					retain = True
+				)
+			for mqtt_conn in list(self.devices):
+				self.dispatch(mqtt_conn, mqtt_conn._on_connect, client, userdata, flags, reason_code, properties)
+
+	def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties = None):
+		for mqtt_conn in list(self.devices):
+			self.dispatch(mqtt_conn, mqtt_conn._on_disconnect, client, userdata, disconnect_flags, reason_code, properties)
+
+	def _on_message(self, client, userdata, message):
+		# the HA birth message is handed over to all solmates
+		for mqtt_conn in [m for m in self.devices if m.mqtt_ha_status_topic == message.topic]:
+			self.dispatch(mqtt_conn, mqtt_conn._on_ha_status, message)
+
+		# hand over the message to the solmate that subscribed to the tree of the topic
+		mqtt_conn = self.topics.get(message.topic.rpartition('/')[0])
+		if mqtt_conn:
+			self.dispatch(mqtt_conn, mqtt_conn._on_message, client, userdata, message)
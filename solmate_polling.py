@@ -0,0 +1,236 @@
+import math
+import time
+from datetime import datetime, timedelta, timezone
+import solmate_metrics as sol_metrics
+import solmate_sun as sol_sun
+import solmate_utils as sol_utils
+
+# each polled route has its own interval, 'timer_live' is only the shortest one.
+# the interval of a route is defined with 'timer_route_<route>' and defaults to 'timer_live'.
+# routes are queried on a fixed grid of their interval, aligned to the wall clock when (re)connecting,
+# like every 30s on the full and half minute. the grid follows the monotonic clock and does not drift
+# with the time queries take. if a poll cycle overruns a tick, that tick is skipped and not caught up.
+# the first poll cycle after (re)connecting queries all routes immediately.
+# a route that failed is queried again with the next tick of 'timer_live'.
+# the interval and lateness of the live values cycles are recorded as histograms, see solmate_metrics.py
+#
+# with 'general_adaptive_polling', the interval of 'live_values' adapts between 'timer_live_min'
+# and 'timer_live_max' to how fast the live data changes. the interval is chosen so that the
+# fastest changing value changes by about its significant amount between two queries.
+# a shorter interval is taken immediately, a longer one grows step by step.
+# as the interval changes between polls, it does not use a grid but steps from the previous due time,
+# skipping overrun ticks. it is never queried sooner than 'timer_live_min' after the last query.
+#
+# with 'eet_latitude' and 'eet_longitude' configured, routes are queried with 'timer_night' at night.
+# night is when the solar elevation, calculated locally, is below 'eet_night_elevation' degrees.
+# the night interval never lasts beyond the time the elevation rises above it again (dawn).
+# mqtt commands are processed immediately at night too.
+
+# after writing a value, the route that reads it back is due immediately and queried with the same poll cycle.
+# the time from the write to the published read back is recorded as 'write_confirmed' metric
+refresh_after_write = {
+	'set_boost_injection': 'get_boost_injection',
+	'set_user_minimum_injection': 'get_injection_settings',
+	'set_user_maximum_injection': 'get_injection_settings',
+	'set_user_minimum_battery_percentage': 'get_injection_settings'
+}
+
+# the change of a live value that is significant, pv and inject power in W, battery state as fraction
+significant_change = {
+	'pv_power': 20,
+	'inject_power': 20,
+	'battery_state': 0.01
+}
+
+# the maximum factor the live interval grows with one decision
+adaptive_growth = 1.5
+
+class route_schedule:
+	# keeps track when each route is due
+
+	def __init__(self):
+		self.due = {}				# route --> when the route is due next (monotonic)
+		self.live_interval = None	# the current adaptive interval of 'live_values'
+		self.last_live = None		# (time, response) of the last live values
+		self.location = _location()	# (latitude, longitude, elevation) or none
+		self.dawn = None			# the next dawn (utc) if it is night
+		self.last_cycle = None		# when the live values were queried the last time (monotonic)
+		self.offset = _wall_offset()	# wall clock minus monotonic clock, aligns the grid
+		self.written_at = {}		# route reading back a write --> when the first write was sent (monotonic)
+
+	def interval(self, route):
+		# the seconds between two queries of the route
+		if route == 'live_values' and self.live_interval is not None:
+			interval = self.live_interval
+		elif 'timer_route_' + route in sol_utils.merged_config:
+			interval = sol_utils.merged_config['timer_route_' + route]
+		else:
+			interval = sol_utils.merged_config['timer_live']
+		return interval
+
+	def _tick(self, interval, now):
+		# the next point of the grid of the interval strictly after now (monotonic)
+		interval = max(interval, 1)
+		return (math.floor((now + self.offset) / interval) + 1) * interval - self.offset
+
+	def _step(self, previous, interval, now):
+		# the previous due time plus the interval, skipping ticks that were overrun (monotonic)
+		interval = max(interval, 1)
+		due = previous + interval
+		if due <= now:
+			due += (math.floor((now - due) / interval) + 1) * interval
+		return due
+
+	def _next_due(self, interval, now, previous = None):
+		# when a route with the interval is due next
+		# on the grid of the interval or, with a previous due time, stepping from that one
+		if previous is None:
+			due = self._tick(interval, now)
+		else:
+			due = self._step(previous, interval, now)
+		night = self._night_seconds()
+		if night:
+			# at night, query slower but wake up at dawn
+			slow = self._tick(max(interval, sol_utils.merged_config['timer_night']), now)
+			due = max(due, min(slow, now + night))
+		return due
+
+	def _night_seconds(self):
+		# return the seconds until dawn if it is night, else 0
+		if self.location is None:
+			return 0
+
+		latitude, longitude, threshold = self.location
+		now = datetime.now(timezone.utc)
+
+		if self.dawn is not None and now < self.dawn:
+			return (self.dawn - now).total_seconds()
+
+		if sol_sun.elevation(now, latitude, longitude) >= threshold:
+			if self.dawn is not None:
+				sol_utils.logging('Polling: Day mode.')
+				self.dawn = None
+			return 0
+
+		# it is night, the next dawn is calculated once per night
+		self.dawn = sol_sun.next_rise(now, latitude, longitude, threshold)
+		if self.dawn is None:
+			# polar night, check again after the night interval
+			self.dawn = now + timedelta(seconds = sol_utils.merged_config['timer_night'])
+		sol_utils.logging('Polling: Night mode until: ' + self.dawn.astimezone().strftime('%Y-%m-%dT%H:%M:%S'))
+		return (self.dawn - now).total_seconds()
+
+	def clear(self):
+		# all routes are due, like after a reconnect
+		# the grid is realigned to the wall clock which may have been changed meanwhile
+		self.due.clear()
+		self.written_at.clear()
+		self.last_cycle = None
+		self.offset = _wall_offset()
+
+	def due_requests(self, requests):
+		# return the (route, data) requests that are due
+		now = sol_metrics.now()
+		requests = [(route, data) for route, data in requests if self.due.get(route, 0) <= now]
+		if any(route == 'live_values' for route, data in requests):
+			self._cycle(now)
+		return requests
+
+	def _cycle(self, now):
+		# record the interval since the last live values cycle and how late this one starts
+		if 'live_values' in self.due:
+			sol_metrics.record_histogram('cycle_lateness', now - self.due['live_values'])
+		if self.last_cycle is not None:
+			sol_metrics.record_histogram('cycle_interval', now - self.last_cycle)
+		self.last_cycle = now
+
+	def polled(self, results):
+		# schedule the next query of all routes that were successfully queried
+		now = sol_metrics.now()
+		for route, response in results.items():
+			if not response or isinstance(response, Exception):
+				self._schedule(route, min(self.interval(route), sol_utils.merged_config['timer_live']), now)
+				continue
+			if route in self.written_at:
+				sol_metrics.record('write_confirmed', now - self.written_at.pop(route))
+			if route == 'live_values' and sol_utils.merged_config['general_adaptive_polling']:
+				self._adapt(now, response)
+			interval = self.interval(route)
+			if route == 'get_boost_injection' and response.get('remaining_time'):
+				# while a boost is running, its remaining time counts down with the live values
+				interval = min(interval, sol_utils.merged_config['timer_live'])
+			self._schedule(route, interval, now)
+
+	def _schedule(self, route, interval, now):
+		# set when the route is due next
+		if route == 'live_values' and sol_utils.merged_config['general_adaptive_polling']:
+			# the next tick of the grid of a changed interval can be almost immediate,
+			# step from the due time of this cycle or its start after (re)connecting
+			due = self._next_due(interval, now, self.due.get(route, self.last_cycle))
+			if self.last_cycle is not None:
+				due = max(due, self.last_cycle + sol_utils.merged_config['timer_live_min'])
+		else:
+			due = self._next_due(interval, now)
+		self.due[route] = due
+
+	def wait_seconds(self):
+		# the seconds until the next route is due
+		if not self.due:
+			return sol_utils.merged_config['timer_live']
+		return max(0, min(self.due.values()) - sol_metrics.now())
+
+	def _adapt(self, now, response):
+		# adapt the live interval to the rate of change of the live values
+		low = sol_utils.merged_config['timer_live_min']
+		high = max(low, sol_utils.merged_config['timer_live_max'])
+		current = self.live_interval or min(max(sol_utils.merged_config['timer_live'], low), high)
+
+		last = self.last_live
+		self.last_live = (now, response)
+		if last is None or now <= last[0]:
+			self.live_interval = current
+			return
+
+		# the field changing fastest relative to its significant change decides
+		target = high
+		reason = 'no significant change'
+		for field, change in significant_change.items():
+			try:
+				rate = abs(float(response[field]) - float(last[1][field])) / (now - last[0])
+			except (KeyError, TypeError, ValueError):
+				continue
+			if rate > 0 and change / rate < target:
+				target = change / rate
+				reason = field + ' ' + format(rate, '.3g') + '/s'
+
+		interval = max(low, target)
+		if interval > current:
+			interval = min(interval, current * adaptive_growth)
+		self.live_interval = interval
+		sol_metrics.record('live_interval', interval)
+
+		# log each decision to allow tuning
+		sol_utils.logging('Polling: live_values interval ' + format(current, '.1f') + 's -> ' + format(interval, '.1f') + 's (' + reason + ')')
+
+	def written(self, route, start):
+		# a value was written at start, read it back with the next poll cycle
+		if route in refresh_after_write:
+			self.due.pop(refresh_after_write[route], None)
+			self.written_at.setdefault(refresh_after_write[route], start)
+
+def _wall_offset():
+	# the difference between the wall clock and the monotonic clock
+	return time.time() - sol_metrics.now()
+
+def _location():
+	# get the configured location for the night mode or none if not configured
+	# the values are configured as strings and converted here
+	latitude = sol_utils.merged_config['eet_latitude']
+	longitude = sol_utils.merged_config['eet_longitude']
+	if latitude is False or longitude is False:
+		return None
+	try:
+		return float(latitude), float(longitude), float(sol_utils.merged_config['eet_night_elevation'])
+	except (TypeError, ValueError):
+		sol_utils.logging('Polling: Invalid eet_latitude, eet_longitude or eet_night_elevation, night mode disabled.')
+		return None
@@ -0,0 +1,102 @@
+import asyncio
+import socket
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+# non blocking reachability probes for the solmate and the mqtt server
+# a probe only checks if a tcp connection to host:port can be opened, it does not speak any protocol.
+# all probes run on the event loop with a short timeout and can run in parallel.
+# resolved addresses are cached for 'timer_dns_cache' seconds, a failed probe drops the cache entry
+# so a changed address is picked up with the next probe.
+
+# host --> (list of addresses, time resolved)
+dns_cache = {}
+
+# default ports if the uri does not contain one
+default_ports = {
+	'wss': 443,
+	'ws': 80
+}
+
+def solmate_target(uri = None):
+	# return the host and port of the solmate or cloud server, defaults to the configured one
+	uri = uri or sol_utils.merged_config['eet_server_uri']
+	host, port = sol_utils.strip_host_port(uri)
+	if not int(port):
+		port = default_ports.get(uri.partition(':')[0].lower(), 443)
+	return host, int(port)
+
+def mqtt_target():
+	# return the host and port of the configured mqtt server
+	host, port = sol_utils.strip_host_port(sol_utils.merged_config['mqtt_server'])
+	return host, int(sol_utils.merged_config['mqtt_port'])
+
+async def _resolve(host, port):
+	# resolve the host or take the addresses from the cache
+	global dns_cache
+
+	cached = dns_cache.get(host)
+	if cached and sol_metrics.now() - cached[1] < sol_utils.merged_config['timer_dns_cache']:
+		return cached[0]
+
+	loop = asyncio.get_running_loop()
+	infos = await loop.getaddrinfo(host, port, type = socket.SOCK_STREAM)
+	addresses = list(dict.fromkeys(info[4][0] for info in infos))
+	dns_cache[host] = (addresses, sol_metrics.now())
+	return addresses
+
+async def _connect(host, port):
+	# try to open a tcp connection to the first address that answers
+	for address in await _resolve(host, port):
+		try:
+			reader, writer = await asyncio.open_connection(address, port)
+		except OSError:
+			continue
+		writer.close()
+		try:
+			await writer.wait_closed()
+		except OSError:
+			# the connection was established, that is all we wanted to know
+			pass
+		return True
+	return False
+
+async def probe(host, port):
+	# check if host:port is reachable, returns true or false but never raises
+	start = sol_metrics.now()
+	try:
+		result = await asyncio.wait_for(_connect(host, port), sol_utils.merged_config['timer_probe'])
+	except Exception:
+		result = False
+	sol_metrics.record_since('probe', start)
+
+	if not result:
+		dns_cache.pop(host, None)
+	return result
+
+async def probe_targets(uri = None, log = True):
+	# probe the solmate and, if used, the mqtt server in parallel
+	# uri is the one of the solmate in use, in dual path mode this can be the standby one
+	# returns a dictionary with the source as key like it is used in raised exceptions
+	targets = {'websocket': solmate_target(uri)}
+	if sol_utils.merged_config['general_use_mqtt']:
+		targets['mqtt'] = mqtt_target()
+
+	results = await asyncio.gather(*(probe(host, port) for host, port in targets.values()))
+	reachable = dict(zip(targets.keys(), results))
+
+	if log:
+		if not reachable['websocket']:
+			host, port = targets['websocket']
+			sol_utils.logging('Main: No reply from Solmate: ' + str(host) + ':' + str(port))
+		if 'mqtt' in reachable and not reachable['mqtt']:
+			host, port = targets['mqtt']
+			sol_utils.logging('Main: No reply from MQTT server: ' + str(host) + ':' + str(port))
+
+	return reachable
+
+async def probe_mqtt():
+	# probe the mqtt server only, used when paho reports a disconnect
+	host, port = mqtt_target()
+	if not await probe(host, port):
+		sol_utils.logging('MQTT: No reply from MQTT server: ' + str(host) + ':' + str(port))
@@ -0,0 +1,105 @@
+import random
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+# the reconnect policy decides how long to wait before reconnecting after a failure.
+# each failure class has its own exponential backoff: the first wait is 'base' seconds,
+# each consecutive failure multiplies it by 'timer_backoff_factor' up to 'cap' seconds.
+# a random jitter of +/- 'timer_backoff_jitter' percent spreads reconnects of many clients.
+# the backoff is only reset when the connection stayed up for 'timer_backoff_reset' seconds,
+# a connection that flaps keeps on backing off.
+#
+# the failure class is assembled from the source and the reason of the exception raised
+# like Exception('websocket', 'offline') --> 'websocket_offline'
+#
+# defaults for base and cap are taken from the existing timers and can be overwritten per class
+# with 'timer_backoff_base_<class>' and 'timer_backoff_cap_<class>'
+
+policies = {
+	# the solmate or cloud server can not be reached at all
+	'websocket_offline': ('timer_min', 'timer_offline'),
+	# authentication failed, this is usually a server side issue
+	'websocket_auth': ('timer_conn_err', 'timer_offline'),
+	# a request failed or the connection was closed
+	'websocket_conn_err': ('timer_min', 'timer_conn_err'),
+	# requests were not answered in time
+	'websocket_timeout': ('timer_min', 'timer_conn_err'),
+	# the websocket keepalive ping/pong failed
+	'websocket_keepalive': ('timer_min', 'timer_conn_err'),
+	# the mqtt broker can not be reached
+	'mqtt_offline': ('timer_min', 'timer_offline'),
+	# publishing to the mqtt broker failed
+	'mqtt_conn_err': ('timer_min', 'timer_conn_err'),
+	# the solmate reboots, there is no need to try earlier
+	'reboot': ('timer_reboot', 'timer_reboot')
+}
+
+class reconnect_policy:
+	# keeps track of consecutive failures per failure class
+
+	def __init__(self):
+		self.attempts = {}				# consecutive failures per failure class
+		self.failed_since = {}			# when the first of the consecutive failures happened
+		self.connected_since = None		# when the connections were (re)established
+
+	def _timer(self, failure, kind, default):
+		# get the configured timer for the failure class or the default timer
+		key = 'timer_backoff_' + kind + '_' + failure
+		if key in sol_utils.merged_config:
+			return sol_utils.merged_config[key]
+		return sol_utils.merged_config[default]
+
+	def delay(self, failure):
+		# register a failure and return the seconds to wait before reconnecting
+		now = sol_metrics.now()
+
+		if self.connected_since is not None:
+			if now - self.connected_since >= sol_utils.merged_config['timer_backoff_reset']:
+				# the connection was stable long enough, start over
+				self.attempts.clear()
+			self.connected_since = None
+
+		if failure not in policies:
+			# an unknown failure class should not happen, be conservative
+			failure = 'websocket_offline'
+
+		base_timer, cap_timer = policies[failure]
+		base = self._timer(failure, 'base', base_timer)
+		cap = max(base, self._timer(failure, 'cap', cap_timer))
+
+		attempt = self.attempts.get(failure, 0)
+		self.attempts[failure] = attempt + 1
+		self.failed_since.setdefault(failure, now)
+
+		seconds = min(cap, base * sol_utils.merged_config['timer_backoff_factor'] ** attempt)
+		if base < cap:
+			jitter = sol_utils.merged_config['timer_backoff_jitter'] / 100
+			seconds = min(cap, seconds * random.uniform(1 - jitter, 1 + jitter))
+
+		return max(seconds, 0)
+
+	def refine(self, failure, reachable):
+		# adjust the failure class with the result of the reachability probes
+		# if the target does not answer on tcp level, it is offline whatever the error was
+		# if it answers but was reported offline, the service is likely just restarting
+		source = failure.partition('_')[0]
+		if source not in reachable:
+			return failure
+		if not reachable[source]:
+			return source + '_offline'
+		if failure == source + '_offline':
+			return source + '_conn_err'
+		return failure
+
+	def connected(self):
+		# all connections are (re)established, record how long reconnecting took
+		# the outage is accounted to the failure class that started it
+		now = sol_metrics.now()
+		self.connected_since = now
+
+		if self.failed_since:
+			failure = min(self.failed_since, key = self.failed_since.get)
+			duration = now - self.failed_since[failure]
+			sol_metrics.record('reconnect_' + failure, duration)
+			sol_utils.logging('Main: Reconnected after ' + failure + ' in ' + format(duration, '.1f') + 's')
+			self.failed_since.clear()
@@ -0,0 +1,37 @@
+import math
+from datetime import timedelta
+
+# calculate the solar elevation locally from latitude and longitude, no network access needed.
+# based on the NOAA general solar position approximation, accurate to a fraction of a degree
+# which is more than enough to decide between day and night.
+# https://gml.noaa.gov/grad/solcalc/solareqns.PDF
+
+def elevation(when, latitude, longitude):
+	# return the solar elevation in degrees for the utc datetime, latitude and longitude given
+	# latitude is positive to the north, longitude positive to the east
+	hour = when.hour + when.minute / 60 + when.second / 3600
+	gamma = 2 * math.pi / 365 * (when.timetuple().tm_yday - 1 + (hour - 12) / 24)
+
+	# equation of time in minutes and solar declination in radians
+	eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+		- 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+	decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+		- 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+		- 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+
+	# true solar time in minutes and the hour angle
+	solar_time = hour * 60 + eqtime + 4 * longitude
+	hour_angle = math.radians(solar_time / 4 - 180)
+
+	lat = math.radians(latitude)
+	cos_zenith = math.sin(lat) * math.sin(decl) + math.cos(lat) * math.cos(decl) * math.cos(hour_angle)
+	return 90 - math.degrees(math.acos(max(-1, min(1, cos_zenith))))
+
+def next_rise(when, latitude, longitude, threshold, step = 300):
+	# return the next utc datetime the solar elevation rises above the threshold
+	# searched in steps of seconds within the next day, none if it does not rise (polar night)
+	for n in range(1, 86400 // step + 1):
+		moment = when + timedelta(seconds = n * step)
+		if elevation(moment, latitude, longitude) >= threshold:
+			return moment
+	return None
@@ -1,47 +1,158 @@
 import asyncio
+import collections.abc
+import contextvars
+import json
 import os
-import queue
 import sys
 import syslog
-import socket
+import threading
 from datetime import datetime
 from importlib import metadata
 
 # functions here are provided for general availability
 
-# create a new queue which can be accessed from all importing modules
-# we use it for the communication between mqtt and the main loop
-# each element contains a tuple (route, key, value), set by mqtt on message recieved
-# this defines updates to be sent to solmate 
-mqtt_queue = queue.Queue()
+class command_buffer:
+	# the queue of writes from mqtt to the solmate, coalescing writes not yet sent
+	# an element is a tuple (route, data), data is a dictionary of the fields to write.
+	# a write to a route that is still pending is merged into the pending one, later values
+	# replace earlier ones field by field. dragging a slider in HA therefore costs one write only.
+	# 'shutdown' is never merged and keeps its position, writes before it are sent before,
+	# writes after it are sent after and are not merged into writes before it.
+	# filled by the paho thread and emptied by the main loop
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.elements = collections.deque()	# [route, data] in the order to send
+		self.pending = {}					# route --> its element not yet sent since the last 'shutdown'
+
+	def qsize(self):
+		return len(self.elements)
+
+	def put(self, item):
+		route, data = item
+		with self.lock:
+			if route == 'shutdown':
+				self.elements.append([route, dict(data)])
+				self.pending.clear()
+			elif route in self.pending:
+				self.pending[route][1].update(data)
+			else:
+				element = [route, dict(data)]
+				self.elements.append(element)
+				self.pending[route] = element
+
+	def get(self):
+		with self.lock:
+			element = self.elements.popleft()
+			if self.pending.get(element[0]) is element:
+				del self.pending[element[0]]
+			return element[0], element[1]
+
+	def pending_data(self, route):
+		# the fields of the route not sent yet, used to complete writes that need more than one field
+		with self.lock:
+			element = self.pending.get(route)
+			return dict(element[1]) if element else {}
+
+class device:
+	# the config and the mqtt queue of one solmate
+	# in fleet mode, one process handles multiple solmates each running in its own task.
+	# the device of a task is set in a context variable, 'merged_config' and 'mqtt_queue'
+	# below resolve to the device of the task (or paho callback) accessing them.
+	# without fleet mode, there is only the default device.
+
+	def __init__(self, name = ''):
+		self.name = name				# used to prefix log messages in fleet mode
+		self.config = {}
+		# we use the queue for the communication between mqtt and the main loop
+		# each element contains a tuple (route, data), set by mqtt on message recieved
+		# this defines updates to be sent to solmate, see 'command_buffer'
+		self.queue = command_buffer()
+		# set when an element was added to the queue, wakes up the main loop waiting in 'timer_wait'
+		# the queue is filled by the paho thread, the event belongs to the event loop of the main loop
+		self.wakeup = None
+		self.loop = None
+		# the metrics of the device, see solmate_metrics.py
+		self.metrics = None
+
+	def put(self, item):
+		# add an element to the queue and wake up the main loop, can be called from any thread
+		self.queue.put(item)
+		if self.loop is not None:
+			try:
+				self.loop.call_soon_threadsafe(self.wakeup.set)
+			except RuntimeError:
+				# the event loop is closed, the element is picked up by the next one
+				pass
+
+	async def wait(self, seconds):
+		# wait the seconds given but return immediately if an element is or gets added to the queue
+		loop = asyncio.get_running_loop()
+		if self.loop is not loop:
+			self.loop = loop
+			self.wakeup = asyncio.Event()
+		self.wakeup.clear()
+		if self.queue.qsize() != 0:
+			return
+		try:
+			await asyncio.wait_for(self.wakeup.wait(), seconds)
+		except asyncio.TimeoutError:
+			pass
 
-# provide a global available config variable 
-merged_config = {}
+# the device of the current task
+current_device = contextvars.ContextVar('current_device', default = device())
 
-# properly create an async loop because of a warning popping up with python >=3.10:
-# DeprecationWarning: There is no current event loop
-# https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.get_event_loop
-# https://stackoverflow.com/questions/73884117/how-to-replace-asyncio-get-event-loop-to-avoid-the-deprecationwarning
-# https://stackoverflow.com/questions/46727787/runtimeerror-there-is-no-current-event-loop-in-thread-in-async-apscheduler
-def create_async_loop():
+class _device_config(collections.abc.MutableMapping):
+	# the config of the current device, accessed like a dictionary
 
-	try:
-		# we first try the old way
-		loop = asyncio.get_event_loop()
-	except RuntimeError as err:
-		# ok, that was not working, do it the new way
-		if str(err).startswith('There is no current event loop in thread'):
-			loop = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop)
-		else:
-			# if that also not worked, raise the error to track it
-			raise
-	return loop
+	def __getitem__(self, key):
+		return current_device.get().config[key]
+
+	def __setitem__(self, key, value):
+		current_device.get().config[key] = value
+
+	def __delitem__(self, key):
+		del current_device.get().config[key]
+
+	def __iter__(self):
+		return iter(current_device.get().config)
+
+	def __len__(self):
+		return len(current_device.get().config)
+
+class _device_queue:
+	# the mqtt queue of the current device
+
+	def qsize(self):
+		return current_device.get().queue.qsize()
+
+	def get(self):
+		return current_device.get().queue.get()
+
+	def put(self, item):
+		current_device.get().put(item)
+
+	def pending_data(self, route):
+		return current_device.get().queue.pending_data(route)
+
+# the queue which can be accessed from all importing modules
+mqtt_queue = _device_queue()
+
+# provide a global available config variable
+merged_config = _device_config()
+
+def set_config(config):
+	# hand over the config for the current device
+	current_device.get().config = config
 
 def logging(message):
 	# print logging data to console (conditional) and syslog (always)
 	global merged_config
 
+	# in fleet mode, prefix the message with the name of the device
+	if current_device.get().name:
+		message = '[' + current_device.get().name + '] ' + str(message)
+
 	# mandatory print the message on the console if defined
 	if merged_config['general_console_print']:
 		if merged_config['general_console_timestamp']:
@@ -63,31 +174,24 @@ def logging(message):
 		self = merged_config['internal_access_self']
 		self.log(message)
 
-async def _async_timer(timer_value):
-	# run an async timer
-	await asyncio.sleep(timer_value)
-
-def timer_wait(timer_name, process_queue = True):
+async def timer_wait(timer_name, process_queue = True):
 	# wait the number of seconds passed via the name as argument
+	await timer_wait_seconds(merged_config[timer_name], process_queue)
 
-	# mqtt_queue is defined on the module level
-	global mqtt_queue
-	global merged_config
+async def timer_wait_seconds(seconds, process_queue = True):
+	# wait the number of seconds passed as argument
 
 	# wait, but let other tasks like websocket or mqtt do its backend stuff.
-	# timer.sleep would hard block that
-	# using a range object to count down in steps of half a second
-	# by that, we can check the presense for a new queue object (injected by mqtt)
-	# if a new queue object was identified, just leave
-	for x in range(merged_config[timer_name] * 2):
-		# check if the queue has an item to process. in case exit the for loop
-		# but only if there is no processing of an mqtt command like reboot
-		# there we have already a mqtt_queue item and we must pass the waiting time
-		if process_queue:
-			# if mqtt is not active, there will also never be an element added to the queue
-			if mqtt_queue.qsize() != 0:
-				break
-		create_async_loop().run_until_complete(_async_timer(0.5))
+	# the wait is done on the one and only event loop the program runs on,
+	# by that websocket keepalive pings are serviced while we are waiting.
+	# if a new queue object gets injected by mqtt, the wait ends immediately
+	# but only if there is no processing of an mqtt command like reboot
+	# there we have already a mqtt_queue item and we must pass the waiting time
+	if process_queue:
+		# if mqtt is not active, there will also never be an element added to the queue
+		await current_device.get().wait(seconds)
+	else:
+		await asyncio.sleep(seconds)
 
 def print_request_response(route, response):
 	# print response in formatted or unformatted json
@@ -209,22 +313,39 @@ def restart_program(counter=0, mqtt=False):
 	sys.stdout.flush()
 	os.execv(sys.executable, ['python'] + sys.argv)
 
-def isOpen(host, port):
-	# check if host:port is reachable
+def _state_file(name):
+	# return the full path of a state file or false if persisting state is disabled
+	folder = merged_config['general_state_folder']
+	if not folder:
+		return False
+	return os.path.join(merged_config['general_install_path'], folder, name + '.json')
+
+def load_state(name):
+	# load a formerly persisted state dictionary
+	# returns an empty dictionary if there is none or it can not be read
+	path = _state_file(name)
+	if not path or not os.path.isfile(path):
+		return {}
 	try:
-		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		#2 second timeout
-		sock.settimeout(2)
-		result = sock.connect_ex((host,int(port)))
-		if result == 0:
-			# port is open
-			return True
-		else:
-			# port is closed
-			return False
+		with open(path, 'r') as f:
+			return json.load(f)
 	except Exception as err:
-		logging('Main: Try to do a socket check failed: ' + str(err))
-		return False
+		logging('Utils: Could not read state file: ' + path + ' ' + str(err))
+		return {}
+
+def save_state(name, state):
+	# persist a state dictionary so it survives restarts
+	# the file is only readable by the user as it can contain session data
+	# errors are logged but do not stop the program, the state is just not persisted
+	path = _state_file(name)
+	if not path:
+		return
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+			json.dump(state, f, indent = 2)
+	except Exception as err:
+		logging('Utils: Could not write state file: ' + path + ' ' + str(err))
 
 def strip_host_port(url):
 # return the pure hostname and port if exists from the variable given
@@ -1,49 +1,94 @@
 import asyncio
 import base64
 import hashlib
-import json
 import os
 import sys
 import syslog
 import time
 import websockets.client
+import solmate_codec as sol_codec
+import solmate_metrics as sol_metrics
 import solmate_utils as sol_utils
 
+# sessions of successful authentications by serial number, kept across reconnects
+# a session contains the signature and the server uri the session was authenticated on.
+# with that, a reconnect can directly authenticate on the correct (cloud) instance
+# without a login and without being redirected by the load-balancer first
+sessions = {}
+
 class connect_to_solmate:
 	# the class managing the connection to solmate (cloud or local)
 	# https://websockets.readthedocs.io/en/stable/reference/asyncio/client.html
 
 	server_uri= ''                              # the endpoint
+	configured_uri = ''                         # the endpoint configured, server_uri can be a redirect
 	websocket = None                            # websocket will be stored here
 	message_id = 0                              # continous message id
-
-	def __init__(self):
-		self.server_uri = sol_utils.merged_config['eet_server_uri']
+	pending = None                              # requests sent waiting for their response by id
+	reader = None                               # task reading responses from the websocket
+	echoes_ids = None                           # if the solmate returns the id of the request, none = unknown
+
+	def __init__(self, configured_uri = None):
+		# the uri defaults to the configured one, in dual path mode it can be the standby one
+		self.configured_uri = configured_uri or sol_utils.merged_config['eet_server_uri']
+		self.server_uri = self.configured_uri
 		self.count_before_restart = 0
+		# consecutive timeouts by route, a slow route is not hidden by others answering in time
+		self.count_timeouts = {}
 		self.message_id = 0
 		self.websocket = None
+		self.pending = {}
+		self.reader = None
+		self.echoes_ids = None
+		# with pipelining, multiple requests can be sent before the first response arrives
+		# responses are correlated by their id. if disabled, requests are strictly serialized
+		self.pipelining = sol_utils.merged_config['general_ws_pipelining']
+		self.request_lock = asyncio.Lock()
 		# set of mandatory keywords in the query response if the endpoint does not exist
 		self.err_kwds = {'Response:', 'NotImplemetedError'}
 
+	async def connect(self):
+		# the websocket can only be created from within the running event loop
+		# therefore connecting is not part of the class initialisation
 		sol_utils.logging('Websocket: Initializing connection')
-		self._create_websocket()
+
+		session = _get_session(self.configured_uri)
+		if session and session['server_uri'] != self.server_uri:
+			# connect directly to the instance the session was authenticated on
+			try:
+				self._redirected_server(session['server_uri'])
+				await self._create_websocket()
+				return
+			except Exception:
+				# the instance is gone, start over with the configured server
+				sol_utils.logging('Websocket: Cached server not reachable, using: ' + self.configured_uri)
+				_drop_session(self.configured_uri)
+				self._redirected_server(self.configured_uri)
+
+		await self._create_websocket()
 
 	def _redirected_server(self, uri):
 		self.server_uri = uri
 
-	def _create_websocket(self):
+	async def _create_websocket(self):
 		# create and connect to websocket
 		try:
-			sol_utils.create_async_loop().run_until_complete(self._create_socket())
+			await self._create_socket()
 		except Exception as err:
 			# the reason for the exception has been logged already, just exit
 			sol_utils.logging('Websocket: Error: ' + str(self.server_uri))
-			raise Exception('websocket', 'timer_offline')
+			raise Exception('websocket', 'offline')
 
-	def _close_websocket(self):
-		# needed for example when redirected
+	async def close(self):
+		# close the websocket, needed when the connection object gets dropped
+		# on the one event loop, the socket and its keepalive would else stay alive
 		if self.websocket is not None:
-			self.websocket.close()
+			try:
+				await self.websocket.close()
+			except Exception:
+				pass
+			self.websocket = None
+		self._stop_reader(ConnectionError('Connection closed by esham.'))
 
 	async def _create_socket(self):
 		# create a websocket and connect it to the endpoint.
@@ -51,22 +96,121 @@ class connect_to_solmate:
 			sol_utils.logging('Websocket: Create socket')
 			if self.websocket is not None:
 				await self.websocket.close()
+			# requests sent on a former socket will never get their response
+			self._stop_reader(ConnectionError('Connection replaced.'))
+			self.echoes_ids = None
 
 			self.websocket = await websockets.client.connect(self.server_uri)
 			# you may want to add additional connect parameters like 'ping_interval=xxx' and 'ping_timeout=xxx'
 			# see the readme.md file for a possible reason
 			sol_utils.logging('Websocket: Connected to: ' + self.server_uri)
+			# all responses are read by one task and handed over to the waiting request
+			self.reader = asyncio.ensure_future(self._read_responses(self.websocket))
 		except Exception as err:
 			sol_utils.logging('Websocket error: ' + str(self.server_uri))
 			sol_utils.logging('Websocket error: ' + str(err) or 'Empty error string returned.')
-			raise Exception('websocket', 'timer_offline')
+			raise Exception('websocket', 'offline')
+
+	def is_open(self):
+		# true if the websocket is connected and its responses are read
+		return (self.websocket is not None and self.websocket.open
+			and self.reader is not None and not self.reader.done())
+
+	def _stop_reader(self, err):
+		# stop reading responses and fail all requests still waiting for one
+		if self.reader is not None:
+			self.reader.cancel()
+			self.reader = None
+		self._fail_pending(err)
+
+	def _fail_pending(self, err):
+		# tell all requests waiting for a response that there will be none
+		for future in self.pending.values():
+			if not future.done():
+				future.set_exception(err)
+		self.pending.clear()
+
+	async def _read_responses(self, websocket):
+		# read all responses from the websocket and resolve the future of the matching request
+		# the solmate returns the id of the request with the response.
+		# if it does not, responses can only be matched by order. this is decided once per connection
+		# with the first response, else a late or unsolicited response without id would be taken
+		# as the response of an unrelated request
+		try:
+			while True:
+				frame = await websocket.recv()
+				try:
+					response = sol_codec.loads(frame)
+				except ValueError as err:
+					# a broken frame does not break the connection, the request waiting for it times out
+					sol_utils.logging('Websocket: Dropped undecodable response: ' + str(err))
+					continue
+				message_id = response.get('id') if isinstance(response, dict) else None
+				if self.echoes_ids is None:
+					self.echoes_ids = message_id is not None
+				future = self.pending.pop(message_id, None)
+				if future is None and not self.echoes_ids and self.pending:
+					# the solmate does not return ids, the oldest request first
+					future = self.pending.pop(next(iter(self.pending)))
+				if future is None:
+					# the response belongs to a request no one waits for anymore
+					continue
+				if not future.done():
+					future.set_result(response)
+
+		except asyncio.CancelledError:
+			raise
+
+		except Exception as err:
+			# the connection is gone, all waiting requests get the reason
+			self._fail_pending(err)
+
+	async def _submit_api_request(self, data):
+		# send an api request with a new id without waiting for the response
+		# the returned future resolves with the response for exactly this request
+		self.message_id += 1
+		data['id'] = self.message_id
+		future = asyncio.get_running_loop().create_future()
+		self.pending[self.message_id] = future
+		try:
+			await self.websocket.send(sol_codec.dumps_text(data))
+		except Exception:
+			self.pending.pop(data['id'], None)
+			raise
+		return future
+
+	async def _await_response(self, data):
+		# send the request and wait for its response, but not longer than the timeout for the route
+		# on a timeout, the request is removed from the pending ones. if its response arrives later,
+		# it is dropped by the reader and can not be taken as the response of another request.
+		# this needs responses with ids. if responses are matched by order (or it is not known yet),
+		# the late response would be taken for the next request, the connection is closed instead
+		future = await self._submit_api_request(data)
+		try:
+			return await asyncio.wait_for(future, _request_timeout(data['route']))
+		except asyncio.TimeoutError:
+			self.pending.pop(data['id'], None)
+			if not self.echoes_ids:
+				sol_utils.logging('Websocket: No response for route \'' + data['route'] + '\' in time, responses can not be matched anymore.')
+				await self.close()
+				raise ConnectionError('Responses can not be matched after a timeout.')
+			raise TimeoutError('No response for route \'' + data['route'] + '\' in time.')
 
 	async def _send_api_request(self, data, silent = False):
 		# send an api request with the given data and return response data.
 		try:
-			self.message_id += 1
-			await self.websocket.send(json.dumps(data))
-			response = json.loads(await self.websocket.recv())
+			if self.pipelining:
+				response = await self._await_response(data)
+			else:
+				# only one request on the wire at a time
+				async with self.request_lock:
+					response = await self._await_response(data)
+
+		# specific, when the solmate did not respond in time
+		except TimeoutError as err:
+			if not silent:
+				sol_utils.logging('Websocket: Request: ' + str(err))
+			raise
 
 		# specific, when the connection got closed
 		except websockets.exceptions.ConnectionClosedOK:
@@ -99,38 +243,89 @@ class connect_to_solmate:
 			sol_utils.logging(err)
 			raise Exception(err)
 
-	def ws_request(self, route, data, silent = False):
+	async def ws_request(self, route, data, silent = False):
 		# send request for the given route without error handling
 		try:
-			response = sol_utils.create_async_loop().run_until_complete(
-				self._send_api_request(
-					{'id': self.message_id, 'route': route, 'data': data}, silent
-				)
+			response = await self._send_api_request(
+				{'route': route, 'data': data}, silent
 			)
 			return response
 
+		except TimeoutError:
+			# a timeout is handled on its own, the connection may still be fine
+			raise
+
 		except Exception as err:
-			# an asyncio event loop is thread-specific
-			# if there is a thread error, access was out of the current thread!
-			# with such an error, we safely reconnect
+			# any error here, including one caused by a closed connection
+			# is handled by safely reconnecting
 			#sol_utils.logging('Error: ' + str(err))
-			raise Exception('websocket', 'timer_conn_err')
+			raise Exception('websocket', 'conn_err')
+
+	async def _resume_session(self, serial_number, session):
+		# try to authenticate with the signature of a former session
+		# returns the response if the session was accepted or false if it was rejected.
+		# only an error or redirect response rejects the session. if there was no response at all
+		# like on a timeout or a connection drop, reconnect and keep the session for the next try
+		if session['server_uri'] != self.server_uri:
+			return False
 
-	def authenticate(self):
+		try:
+			sol_utils.logging('Websocket: Resuming session')
+			response = await self._send_api_request(
+				{
+					'route': 'authenticate',
+					'data': {
+						'serial_num': serial_number,
+						'signature': session['signature'],
+						'device_id': sol_utils.merged_config['eet_device_id']
+					}
+				}, silent = True
+			)
+			# a redirect means that the instance does not know the session anymore
+			if response and not ('redirect' in response and response['redirect'] is not None):
+				sol_utils.logging('Websocket: Session for ' + serial_number + ' resumed!')
+				return response
+
+		except TimeoutError:
+			sol_utils.logging('Websocket: No response resuming the session.')
+			raise Exception('websocket', 'timeout')
+
+		except Exception as err:
+			if not str(err).startswith('Websocket: Response:'):
+				sol_utils.logging('Websocket: Resuming the session failed: ' + str(err))
+				raise Exception('websocket', 'conn_err')
+
+		sol_utils.logging('Websocket: Session rejected, doing a full authentication.')
+		return False
+
+	async def authenticate(self):
 		# authenticate in the cloud or local with the given serial number, password and device id
+		# if there is a session from a former authentication, try to resume it first
+
+		# get the serial number to use for authentication
+		# either the normal sn or, if exists and not empty, the spare sn
+		serial_number = sol_utils.merged_config['eet_spare_serial_number'] or sol_utils.merged_config['eet_serial_number']
+
+		session = _get_session(self.configured_uri)
+		if session:
+			response = await self._resume_session(serial_number, session)
+			if response:
+				return response
+
+			# the session is not valid anymore, start over with the configured server
+			_drop_session(self.configured_uri)
+			if self.server_uri != self.configured_uri:
+				self._redirected_server(self.configured_uri)
+				await self._create_websocket()
 
 		try:
-			# get the serial number to use for authentication
-			# either the normal sn or, if exists and not empty, the spare sn
-			serial_number = sol_utils.merged_config['eet_spare_serial_number'] or sol_utils.merged_config['eet_serial_number']
 
 			# get the response to the request of the login route using login data
 			# important: this only tells if there was success or not like {'success': True|False}
 			# note to expect that the endpoint 'login' exists
 			sol_utils.logging('Websocket: Authenticating')
-			response = sol_utils.create_async_loop().run_until_complete(self._send_api_request(
+			response = await self._send_api_request(
 				{
-					'id': self.message_id,
 					'route': 'login',
 					'data': {
 						'serial_num': serial_number,
@@ -138,7 +333,7 @@ class connect_to_solmate:
 						'device_id': sol_utils.merged_config['eet_device_id']
 					}
 				}
-			))
+			)
 			if 'success' in response and not response['success']:
 				# technically the call was ok, but insuccessful because a pwd mismatch
 				# this is so critical that we exit immediately
@@ -150,7 +345,7 @@ class connect_to_solmate:
 			# the error either comes from the _send_api_request but could possibly be temporary
 			sol_utils.logging(str(err))
 			sol_utils.logging('Websocket: Authentication to ' + serial_number + ' failed!')
-			raise Exception('websocket', 'timer_offline')
+			raise Exception('websocket', 'auth')
 
 		try:
 			# if successful, get the hash to use for authenticated requests
@@ -164,9 +359,8 @@ class connect_to_solmate:
 				correct_server = False
 				while not correct_server:
 					# get the response to the authentication route with the authentication data
-					response = sol_utils.create_async_loop().run_until_complete(self._send_api_request(
+					response = await self._send_api_request(
 						{
-							'id': self.message_id,
 							'route': 'authenticate',
 							'data': {
 								'serial_num': serial_number,
@@ -174,14 +368,14 @@ class connect_to_solmate:
 								'device_id': sol_utils.merged_config['eet_device_id']
 							}
 						}
-					))
+					)
 
 					# if there is a load-balancer handle a redirect
 					if 'redirect' in response and response['redirect'] is not None:
 						redirect_uri = str(response['redirect'])
 						sol_utils.logging('Got redirected to: ' + redirect_uri)
 						self._redirected_server(redirect_uri)
-						sol_utils.create_async_loop().run_until_complete(self._create_socket())
+						await self._create_socket()
 					else:
 						# when there is no redirect parameter, the socket is connected to the correct instance
 						correct_server = True
@@ -189,6 +383,8 @@ class connect_to_solmate:
 				if response:
 					# return the authenticated connection
 					sol_utils.logging('Websocket: Authentication to ' + serial_number + ' successful!')
+					# remember the session for a fast reconnect
+					_set_session(self.configured_uri, signature, self.server_uri)
 					return response
 
 				# there was an empty response which should not happen, may be temporary
@@ -202,34 +398,55 @@ class connect_to_solmate:
 			# the reason may be loadbalancer issues or a failure using the hash
 			sol_utils.logging(str(err))
 			sol_utils.logging('Websocket: Hash based Authentication to ' + serial_number + ' failed!')
-			raise Exception('websocket', 'timer_offline')
+			raise Exception('websocket', 'auth')
 
-	def check_route(self, route, data):
-		# send request for the given route including error handling
+	async def query_optional(self, route, data):
+		# send request for a route that may not exist including error handling
+		# return the response or false if the solmate responded with an error.
+		# if there was no usable response at all, it is unknown if the route exists.
+		# this must not be taken as a missing route, reconnect according the 'conn_err' failure class
 
 		try:
-			self.ws_request(route, data, silent = True)
-			# return true if the route exists
-			return True
+			return await self._send_api_request({'route': route, 'data': data}, silent = True)
 
-		except:
-			# return false if not
-			return False
+		except Exception as err:
+			if str(err).startswith('Websocket: Response:'):
+				return False
+			raise Exception('websocket', 'conn_err')
+
+	async def check_route(self, route, data):
+		# send request for the given route including error handling
+		# return true if the route exists and false if not
+		return await self.query_optional(route, data) is not False
 
-	def query_solmate(self, route, data):
+	async def query_solmate(self, route, data):
 		# send request for the given route including error handling
 
 		try: 
-			response = self.ws_request(route, data)
+			response = await self.ws_request(route, data)
 			# request was successful, reset counter
 			self.count_before_restart = 0
+			self.count_timeouts[route] = 0
 			return response
 
+		except TimeoutError:
+			# the solmate did not respond in time, the request has been cancelled
+			# on _consecutive_ timeouts, reconnect according the 'timeout' failure class
+			self.count_timeouts[route] = self.count_timeouts.get(route, 0) + 1
+			sol_metrics.record('request_timeout', _request_timeout(route))
+
+			if self.count_timeouts[route] == sol_utils.merged_config['timer_attempt_restart']:
+				sol_utils.logging('Websocket: Too many consecutive request timeouts for route \'' + route + '\': ' + str(self.count_timeouts[route]))
+				raise Exception('websocket', 'timeout')
+
+			# the false response tells the caller about the incident, it is handled there
+			return False
+
 		except ConnectionError:
-			# if a connection error happened, reconnect after waiting timer_conn_err
+			# if a connection error happened, reconnect according the 'conn_err' failure class
 			# note that a connection error can also occur when a required parameter is not sent
 			# also see '_send_api_request()'
-			raise Exception('websocket', 'timer_conn_err')
+			raise Exception('websocket', 'conn_err')
 
 		except Exception as err:
 			# depending on other exceptions do
@@ -246,9 +463,14 @@ class connect_to_solmate:
 				# the full string is: 'sent 1011 (unexpected error) keepalive ping timeout'
 				# the endpoint existed, but the response was malformed
 				# the websocket keep alive ping/pong failed (see readme.md)
-				# for an immediately restart we need to implement a new timer with value 0 (or 1)
+				# this restarts nearly immediately, see the 'keepalive' failure class in solmate_reconnect
 				sol_utils.logging('Websocket: Keep alive ping/pong failed.')
-				raise Exception('websocket', 'timer_min')
+				raise Exception('websocket', 'keepalive')
+
+			if not self.is_open():
+				# the connection is gone, retrying on it makes no sense
+				sol_utils.logging('Websocket: Connection lost.')
+				raise Exception('websocket', 'conn_err')
 
 			self.count_before_restart += 1
 
@@ -256,9 +478,80 @@ class connect_to_solmate:
 				# only on _consecutive_ unidentified issues
 				# if waiting the response time did not help, restart after the n-th try 
 				sol_utils.logging('Websocket: Too many failed consecutive connection attempts: ' + str(self.count_before_restart))
-				raise Exception('websocket', 'timer_conn_err')
+				raise Exception('websocket', 'conn_err')
 
 			sol_utils.logging('Websocket: A non breaking error happened, continuing.')
 			#sol_utils.logging('Error: ' + str(err))
 			# the false response tells the caller about the incident, it is handled there
 			return False
+
+	async def query_many(self, requests):
+		# send requests for the given list of (route, data) pairs concurrently
+		# return a dictionary with the route as key and either the response, false or the
+		# exception raised as value. each route succeeds or fails on its own, a failing route
+		# does not throw away the responses of the others. it is up to the caller to decide
+		# what to do with an exception returned
+		routes = [route for route, data in requests]
+		responses = await asyncio.gather(
+			*[self.query_solmate(route, data) for route, data in requests],
+			return_exceptions = True
+		)
+
+		results = dict(zip(routes, responses))
+		for route, response in results.items():
+			if isinstance(response, Exception):
+				sol_utils.logging('Websocket: Request for route \'' + route + '\' failed: ' + str(response))
+
+		return results
+
+def _request_timeout(route):
+	# the seconds to wait for the response of a route
+	# either the timeout defined for the route or the default one
+	key = 'timer_request_' + route
+	if key in sol_utils.merged_config:
+		return sol_utils.merged_config[key]
+	return sol_utils.merged_config['timer_request']
+
+def _session_key(configured_uri):
+	# sessions are stored by the serial number configured
+	# the session of the standby path in dual path mode is stored separately
+	key = 'session_' + sol_utils.merged_config['eet_serial_number']
+	if configured_uri != sol_utils.merged_config['eet_server_uri']:
+		key += '_standby'
+	return key
+
+def _get_session(configured_uri):
+	# get the session from memory or, if not present, from the persisted state
+	global sessions
+
+	key = _session_key(configured_uri)
+	if key not in sessions:
+		state = sol_utils.load_state(key)
+		# a session is only valid for the server uri it was created for
+		if state.get('configured_uri') == configured_uri and state.get('signature'):
+			sessions[key] = state
+		else:
+			sessions[key] = None
+
+	return sessions[key]
+
+def _set_session(configured_uri, signature, server_uri):
+	# remember the session in memory and persist it
+	global sessions
+
+	key = _session_key(configured_uri)
+	sessions[key] = {
+		'signature': signature,
+		'server_uri': server_uri,
+		'configured_uri': configured_uri
+	}
+	sol_utils.save_state(key, sessions[key])
+
+def _drop_session(configured_uri):
+	# forget an invalid session
+	global sessions
+
+	key = _session_key(configured_uri)
+	if sessions.get(key):
+		sessions[key] = None
+		sol_utils.save_state(key, {})
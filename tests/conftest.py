@@ -0,0 +1,50 @@
+import os
+import sys
+import pytest
+
+# the modules are not packaged, import them from the esham directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+class _log:
+	# collects log messages instead of writing them to syslog
+	def __init__(self):
+		self.messages = []
+
+	def log(self, message):
+		self.messages.append(message)
+
+@pytest.fixture
+def config():
+	# a minimal config like the defaults of solmate_env.py, tests change what they need
+	log = _log()
+	config = {
+		'general_console_print': False,
+		'general_console_timestamp': False,
+		'internal_access_self': log,
+		'general_adaptive_polling': False,
+		'general_state_folder': False,
+		'general_install_path': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ''),
+		'general_install_folder': 'my_packages',
+		'general_paho_mqtt_version': '2',
+		'eet_latitude': False,
+		'eet_longitude': False,
+		'eet_night_elevation': '-6',
+		'timer_live': 30,
+		'timer_live_min': 10,
+		'timer_live_max': 120,
+		'timer_night': 600
+	}
+	sol_utils.set_config(config)
+	yield config
+	sol_utils.set_config({})
+
+@pytest.fixture
+def clock(monkeypatch):
+	# a monotonic clock the test moves forward
+	class _clock:
+		now = 1000.0
+	monkeypatch.setattr(sol_metrics, 'now', lambda: _clock.now)
+	return _clock
@@ -0,0 +1,45 @@
+import asyncio
+import solmate_connect as sol_connect
+
+class _solmate:
+	# answers the optional queries with the responses given and records the routes queried
+	def __init__(self, responses):
+		self.responses = responses
+		self.queried = []
+
+	async def query_optional(self, route, data):
+		self.queried.append(route)
+		return self.responses.get(route, False)
+
+	async def check_route(self, route, data):
+		return await self.query_optional(route, data) is not False
+
+def test_api_routes_layouts():
+	assert sol_connect._api_routes({'routes': ['live_values', {'route': 'get_injection_settings'}]}) == {'live_values', 'get_injection_settings'}
+	assert sol_connect._api_routes({'get_injection_settings': {'data': {}}}) == {'get_injection_settings'}
+	assert sol_connect._api_routes([{'name': 'live_values'}]) == {'live_values'}
+
+def test_api_routes_ignore_values():
+	# a description or value equal to a route name does not list the route
+	assert sol_connect._api_routes({'routes': {'live_values': {'description': 'get_boost_injection'}}}) == {'live_values'}
+	assert sol_connect._api_routes({'version': 'get_boost_injection'}) == {'version'}
+	assert sol_connect._api_routes('get_boost_injection') == set()
+	assert sol_connect._api_routes({'routes': [['get_boost_injection']]}) == set()
+
+def test_capabilities_without_state_do_not_query_the_version(config):
+	config['eet_serial_number'] = 'S1'
+	solmate = _solmate({'get_api_info': {'routes': ['get_injection_settings']}, 'get_boost_injection': {}})
+	routes = asyncio.run(sol_connect._route_capabilities(solmate, True))
+	assert routes == {'sun2plugHasBoostInjection': True, 'hasUserSettings': True}
+	assert solmate.queried == ['get_api_info', 'get_boost_injection']
+
+def test_capabilities_cached_per_firmware(config, tmp_path):
+	config.update({'eet_serial_number': 'S1', 'general_install_path': str(tmp_path), 'general_state_folder': 'state'})
+	responses = {'get_solmate_info': {'version': '1.0'}, 'get_api_info': {'routes': ['get_injection_settings']}}
+	solmate = _solmate(responses)
+	asyncio.run(sol_connect._route_capabilities(solmate, True))
+
+	solmate = _solmate(responses)
+	routes = asyncio.run(sol_connect._route_capabilities(solmate, True))
+	assert routes == {'sun2plugHasBoostInjection': False, 'hasUserSettings': True}
+	assert solmate.queried == ['get_solmate_info']
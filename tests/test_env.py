@@ -0,0 +1,31 @@
+import solmate_env as sol_env
+import solmate_utils as sol_utils
+
+def _process(tmp_path, lines):
+	# process an env file with the mandatory keys and the lines given
+	env_file = tmp_path / 'test.env'
+	env_file.write_text('\n'.join([
+		'mqtt_server=broker',
+		'mqtt_port=1883',
+		'eet_server_uri="ws://solmate:9124/"',
+		'eet_serial_number="S1"',
+		'general_console_print=False'
+	] + lines) + '\n')
+	sol_env.process_env('test', None, str(env_file))
+	return sol_utils.merged_config
+
+def test_backoff_factor_decimal(config, tmp_path):
+	merged = _process(tmp_path, ['timer_backoff_factor=1.5', 'timer_live=-30'])
+	assert merged['timer_backoff_factor'] == 1.5
+	assert merged['timer_live'] == 30
+
+def test_backoff_factor_below_one(config, tmp_path):
+	assert _process(tmp_path, ['timer_backoff_factor=-2'])['timer_backoff_factor'] == 1
+	assert _process(tmp_path, ['timer_backoff_factor=0.5'])['timer_backoff_factor'] == 1
+
+def test_state_expiry_not_below_heartbeat(config, tmp_path):
+	# the longest interval is the default of timer_route_get_injection_settings
+	merged = _process(tmp_path, ['timer_heartbeat=300', 'timer_state_expiry=60'])
+	assert merged['timer_state_expiry'] == 600
+	assert _process(tmp_path, ['timer_heartbeat=300', 'timer_state_expiry=3600'])['timer_state_expiry'] == 3600
+	assert _process(tmp_path, ['timer_heartbeat=0', 'timer_state_expiry=60'])['timer_state_expiry'] == 0
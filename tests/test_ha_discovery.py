@@ -0,0 +1,138 @@
+import importlib
+import json
+import threading
+
+class _client:
+	# records the publishes instead of sending them
+	def __init__(self):
+		self.published = []
+
+	def publish(self, topic, payload, qos, retain, properties):
+		self.published.append((topic, payload))
+
+def _mqtt(config, device_discovery):
+	# a solmate_mqtt with the attributes publishing the HA configs needs
+	config.update({
+		'mqtt_topic': 'solmate',
+		'eet_serial_number': 'S1234567890',
+		'eet_spare_serial_number': False,
+		'internal_esham_version': 'test',
+		'default_boost_injection_wattage': 500,
+		'default_max_boost_time': 10800,
+		'default_min_boost_time': 0,
+		'default_user_maximum_injection': 800,
+		'default_user_minimum_injection': 0,
+		'default_max_battery': 90,
+		'default_user_minimum_battery_percentage': 0
+	})
+	# the module imports paho according the config and can only be loaded with one
+	sol_mqtt = importlib.import_module('solmate_mqtt')
+	mqtt = object.__new__(sol_mqtt.solmate_mqtt)
+	mqtt.__dict__.update({
+		'mqtt_server': 'broker',
+		'mqtt_port': 1883,
+		'mqtt_topic': 'solmate',
+		'mqtt_ha': 'homeassistant',
+		'mqtt_sensor_topic': 'eet/sensor/solmate',
+		'mqtt_number_topic': 'eet/number/solmate',
+		'mqtt_button_topic': 'eet/button/solmate',
+		'mqtt_sensor_config_topic': 'homeassistant/sensor/solmate',
+		'mqtt_number_config_topic': 'homeassistant/number/solmate',
+		'mqtt_button_config_topic': 'homeassistant/button/solmate',
+		'mqtt_availability_topic': 'eet/sensor/solmate/availability',
+		'mqtt_never_available_topic': 'eet/sensor/solmate/never_available',
+		'mqtt_bridge_topic': None,
+		'mqtt_qos_config': 2,
+		'mqtt_qos_command': 2,
+		'api_available': {'hasUserSettings': True, 'sun2plugHasBoostInjection': True, 'local': True, 'shutdown': True},
+		'ha_device_discovery': device_discovery,
+		'has_ha_config': False,
+		'mqttclient': _client()
+	})
+	return mqtt
+
+def _state(config, tmp_path):
+	config['general_install_path'] = str(tmp_path)
+	config['general_state_folder'] = 'state'
+
+def _migrated(mqtt):
+	return [topic for topic, payload in mqtt.mqttclient.published if payload == b'{"migrate_discovery":true}']
+
+def _cleared(mqtt):
+	return [topic for topic, payload in mqtt.mqttclient.published if payload == '']
+
+def test_without_state_folder_nothing_is_migrated(config):
+	# nothing is known about former publishes, migrating on every start would cost more than it saves
+	mqtt = _mqtt(config, True)
+	mqtt._publish_ha_config()
+	assert mqtt.mqttclient.published == [(mqtt.registry.device_topic, mqtt.registry.device_payload)]
+
+def test_upgrade_to_device_discovery_migrates_entity_configs_once(config, tmp_path):
+	# the state folder has no ha_config yet like after upgrading, the former version had the entity mode only
+	_state(config, tmp_path)
+	mqtt = _mqtt(config, True)
+	mqtt._publish_ha_config()
+	published = mqtt.mqttclient.published
+	entity_topics = [e.config_topic for e in mqtt.registry.entities]
+	device_topic = mqtt.registry.device_topic
+
+	# first migrate the entity configs, then publish the device config, then clear the entity configs
+	count = len(entity_topics)
+	assert published[:count] == [(topic, b'{"migrate_discovery":true}') for topic in entity_topics]
+	assert published[count] == (device_topic, mqtt.registry.device_payload)
+	assert published[count + 1:] == [(topic, '') for topic in entity_topics]
+
+	# the next start does not migrate again
+	mqtt = _mqtt(config, True)
+	mqtt._publish_ha_config()
+	assert mqtt.mqttclient.published == []
+
+def test_entity_discovery_with_unknown_mode_does_not_migrate(config, tmp_path):
+	_state(config, tmp_path)
+	mqtt = _mqtt(config, False)
+	mqtt._publish_ha_config()
+	assert _migrated(mqtt) == _cleared(mqtt) == []
+	assert len(mqtt.mqttclient.published) == len(mqtt.registry.entities)
+
+def test_switch_back_without_hashes_migrates_device_config(config, tmp_path):
+	# the hashes are dropped if the publishes were not acknowledged, the mode is kept
+	_state(config, tmp_path)
+	_mqtt(config, True)._publish_ha_config()
+	state = json.loads((tmp_path / 'state' / 'ha_config.json').read_text())
+	del state['broker:1883_solmate']
+	(tmp_path / 'state' / 'ha_config.json').write_text(json.dumps(state))
+
+	mqtt = _mqtt(config, False)
+	mqtt._publish_ha_config()
+	assert _migrated(mqtt) == _cleared(mqtt) == [mqtt.registry.device_topic]
+
+def test_switching_with_state_migrates_published_topics(config, tmp_path):
+	_state(config, tmp_path)
+	_mqtt(config, False)._publish_ha_config()
+
+	mqtt = _mqtt(config, True)
+	mqtt._publish_ha_config()
+	assert _migrated(mqtt) == _cleared(mqtt) == [e.config_topic for e in mqtt.registry.entities]
+
+	# the state only holds the device config and the mode now
+	state = json.loads((tmp_path / 'state' / 'ha_config.json').read_text())
+	assert list(state['broker:1883_solmate']) == [mqtt.registry.device_topic]
+	assert state['broker:1883_solmate_mode'] == 'device'
+
+class _result:
+	# a publish result acknowledged by the broker after the delay given, none = never
+	def __init__(self, delay):
+		self.event = threading.Event()
+		if delay is not None:
+			threading.Timer(delay, self.event.set).start()
+
+	def wait_for_publish(self, timeout):
+		self.event.wait(timeout)
+
+	def is_published(self):
+		return self.event.is_set()
+
+def test_wait_for_publish(config):
+	sol_mqtt = importlib.import_module('solmate_mqtt')
+	assert sol_mqtt._wait_for_publish([_result(0.01), _result(0.02)], 1)
+	assert not sol_mqtt._wait_for_publish([_result(0.01), _result(None)], 0.1)
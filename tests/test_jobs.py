@@ -0,0 +1,52 @@
+import asyncio
+import time
+import solmate_jobs as sol_jobs
+import solmate_utils as sol_utils
+
+def _job(results, calls):
+	# a job returning the results given one by one
+	async def job(**kwargs):
+		calls.append(kwargs)
+		return results.pop(0)
+	return job
+
+def _state(config, tmp_path):
+	config['general_install_path'] = str(tmp_path)
+	config['general_state_folder'] = 'state'
+	config['eet_serial_number'] = 'S1'
+
+def test_failed_job_is_retried_and_not_recorded(config, tmp_path):
+	_state(config, tmp_path)
+	calls = []
+	jobs = sol_jobs.job_scheduler()
+	jobs.daily('info', _job([False, None], calls), at = '23:45')
+
+	asyncio.run(jobs.run_pending(smws_conn = 'conn'))
+	assert calls == [{'smws_conn': 'conn'}]
+	assert 'info' not in jobs.last_run
+	assert 0 < jobs.wait_seconds() <= config['timer_live']
+
+	# due again after the retry time
+	jobs.retry_at['info'] = time.time()
+	asyncio.run(jobs.run_pending(smws_conn = 'conn'))
+	assert len(calls) == 2
+	assert 'info' in jobs.last_run
+	assert sol_utils.load_state('jobs')['jobs_S1']['info'] == jobs.last_run['info']
+
+def test_at_start_skipped_if_ran_today(config, tmp_path):
+	_state(config, tmp_path)
+	sol_utils.save_state('jobs', {'jobs_S1': {'info': time.time()}})
+	calls = []
+	jobs = sol_jobs.job_scheduler()
+	jobs.daily('info', _job([None], calls), at = '23:45', at_start = True)
+	asyncio.run(jobs.run_pending())
+	assert calls == []
+
+def test_at_start_runs_if_not_ran_today(config, tmp_path):
+	_state(config, tmp_path)
+	sol_utils.save_state('jobs', {'jobs_S1': {'info': time.time() - 2 * 86400}})
+	calls = []
+	jobs = sol_jobs.job_scheduler()
+	jobs.daily('info', _job([None], calls), at = '23:45', at_start = True)
+	asyncio.run(jobs.run_pending())
+	assert calls == [{}]
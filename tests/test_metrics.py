@@ -0,0 +1,29 @@
+import solmate_metrics as sol_metrics
+import solmate_utils as sol_utils
+
+def _with_device(device, callback):
+	# run the callback with the device like a task in fleet mode
+	token = sol_utils.current_device.set(device)
+	try:
+		return callback()
+	finally:
+		sol_utils.current_device.reset(token)
+
+def test_metrics_per_device(config):
+	first = sol_utils.device('solmate_1.env')
+	second = sol_utils.device('solmate_2.env')
+	for device in (first, second):
+		device.config = dict(config, timer_metrics = 60)
+
+	_with_device(first, lambda: sol_metrics.record_histogram('cycle_interval', 30))
+	_with_device(first, lambda: sol_metrics.record_histogram('cycle_interval', 30))
+	_with_device(second, lambda: sol_metrics.record_histogram('cycle_interval', 10))
+
+	assert _with_device(first, lambda: sol_metrics.summary('cycle_interval')).startswith('cycle_interval: count=2 avg=30.000')
+	assert _with_device(second, lambda: sol_metrics.summary('cycle_interval')).startswith('cycle_interval: count=1 avg=10.000')
+	assert _with_device(second, lambda: sol_metrics.histogram_summary('cycle_interval')) == 'cycle_interval: <=10:1'
+
+	# logging the metrics of one device does not reset when the other logs
+	first.metrics.last_logged -= 60
+	_with_device(first, sol_metrics.log_metrics_if_due)
+	assert first.metrics.last_logged > second.metrics.last_logged
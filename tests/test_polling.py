@@ -0,0 +1,65 @@
+import solmate_polling as sol_polling
+
+def _poll(schedule, clock, response, duration = 0.5):
+	# run one poll cycle of the live values at the time they are due
+	clock.now = max(clock.now, schedule.due.get('live_values', clock.now))
+	start = clock.now
+	assert schedule.due_requests([('live_values', None)])
+	clock.now += duration
+	schedule.polled({'live_values': response})
+	return start
+
+def test_fixed_interval_on_grid(config, clock):
+	schedule = sol_polling.route_schedule()
+	starts = [_poll(schedule, clock, {'pv_power': 0}) for i in range(5)]
+	# after the first immediate query, queries land on the grid of the interval
+	for start in starts[1:]:
+		assert round(start + schedule.offset, 6) % 30 == 0
+	assert [round(b - a, 6) for a, b in zip(starts[1:], starts[2:])] == [30, 30, 30]
+
+def test_adaptive_interval_changes_keep_minimum_gap(config, clock):
+	config['general_adaptive_polling'] = True
+	schedule = sol_polling.route_schedule()
+
+	# alternating fast and slow changes of the pv power make the interval jump between polls
+	starts = []
+	power = 0
+	for step in (0, 500, 500, 40, 0, 300, 0, 0, 5, 0, 1000, 0):
+		power += step
+		starts.append(_poll(schedule, clock, {'pv_power': power}))
+
+	gaps = [b - a for a, b in zip(starts, starts[1:])]
+	assert min(gaps) >= config['timer_live_min']
+	assert max(gaps) <= config['timer_live_max']
+
+def test_adaptive_interval_steps_from_previous_due(config, clock):
+	config['general_adaptive_polling'] = True
+	schedule = sol_polling.route_schedule()
+	_poll(schedule, clock, {'pv_power': 0})
+
+	# a changed interval is stepped from the previous due time, not from the grid of the new interval
+	for interval in (37.3, 10.4, 23.9, 10.4):
+		previous = schedule.due['live_values']
+		schedule.live_interval = interval
+		schedule.due_requests([('live_values', None)])
+		clock.now = previous + 0.5
+		schedule._schedule('live_values', interval, clock.now)
+		assert schedule.due['live_values'] == max(previous + interval, schedule.last_cycle + config['timer_live_min'])
+		clock.now = schedule.due['live_values']
+
+def test_adaptive_interval_skips_overrun_ticks(config, clock):
+	config['general_adaptive_polling'] = True
+	schedule = sol_polling.route_schedule()
+	_poll(schedule, clock, {'pv_power': 0})
+	due = schedule.due['live_values']
+	interval = schedule.live_interval
+
+	# a poll cycle taking longer than two intervals does not catch up the missed ticks
+	_poll(schedule, clock, {'pv_power': 0}, duration = 2.5 * interval)
+	assert schedule.due['live_values'] > clock.now
+	assert schedule.due['live_values'] - clock.now <= schedule.live_interval
+
+	# the next due is on the steps of the current interval from the due time of the overrun cycle
+	steps = (schedule.due['live_values'] - due) / schedule.live_interval
+	assert steps >= 2
+	assert abs(steps - round(steps)) < 1e-9
@@ -0,0 +1,22 @@
+import asyncio
+import solmate_probe as sol_probe
+
+async def _probe_standby(config):
+	# the configured solmate does not answer, the standby in use does
+	server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+	port = server.sockets[0].getsockname()[1]
+	config.update({
+		'eet_server_uri': 'ws://127.0.0.1:1/',
+		'general_use_mqtt': False,
+		'timer_probe': 2,
+		'timer_dns_cache': 300
+	})
+	async with server:
+		standby = await sol_probe.probe_targets('ws://127.0.0.1:' + str(port) + '/', log = False)
+		configured = await sol_probe.probe_targets(log = False)
+	return standby, configured
+
+def test_probe_uri_in_use(config):
+	standby, configured = asyncio.run(_probe_standby(config))
+	assert standby == {'websocket': True}
+	assert configured == {'websocket': False}
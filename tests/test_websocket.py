@@ -0,0 +1,114 @@
+import asyncio
+import solmate_websocket as sol_websocket
+
+class _websocket:
+	# hands over the frames given, then waits like an idle connection
+	def __init__(self, frames):
+		self.frames = list(frames)
+
+	async def recv(self):
+		if self.frames:
+			return self.frames.pop(0)
+		await asyncio.Event().wait()
+
+async def _read(config, frames, ids):
+	# run the reader on the frames with requests of the ids pending, return the responses by id
+	config['general_ws_pipelining'] = True
+	config['eet_server_uri'] = 'ws://solmate:9124/'
+	connection = sol_websocket.connect_to_solmate()
+	loop = asyncio.get_running_loop()
+	futures = {message_id: loop.create_future() for message_id in ids}
+	connection.pending.update(futures)
+	reader = asyncio.ensure_future(connection._read_responses(_websocket(frames)))
+	await asyncio.sleep(0)
+	reader.cancel()
+	return connection, reader, {message_id: future.result() for message_id, future in futures.items() if future.done()}
+
+def test_unmatched_response_is_dropped(config):
+	# the late response of a request that timed out must not resolve another request
+	frames = ['{"id":1,"data":{"a":1}}', '{"data":{"late":1}}', '{"id":7,"data":{}}', '{"id":2,"data":{"b":2}}']
+	connection, reader, responses = asyncio.run(_read(config, frames, [1, 2]))
+	assert responses == {1: {'id': 1, 'data': {'a': 1}}, 2: {'id': 2, 'data': {'b': 2}}}
+
+def test_responses_without_ids_match_by_order(config):
+	frames = ['{"data":{"a":1}}', '{"data":{"b":2}}']
+	connection, reader, responses = asyncio.run(_read(config, frames, [1, 2]))
+	assert responses == {1: {'data': {'a': 1}}, 2: {'data': {'b': 2}}}
+
+def test_undecodable_frame_keeps_reading(config):
+	frames = ['{"id":1,"da', '{"id":1,"data":{"a":1}}']
+	connection, reader, responses = asyncio.run(_read(config, frames, [1]))
+	assert responses == {1: {'id': 1, 'data': {'a': 1}}}
+
+class _silent_websocket(_websocket):
+	# answers without ids, but the second request gets no response in time
+	open = True
+
+	async def send(self, frame):
+		pass
+
+	async def close(self):
+		self.open = False
+
+async def _timeout_without_ids(config):
+	config.update({'general_ws_pipelining': True, 'eet_server_uri': 'ws://solmate:9124/', 'timer_request': 0.01})
+	connection = sol_websocket.connect_to_solmate()
+	websocket = _silent_websocket(['{"data":{"a":1}}'])
+	connection.websocket = websocket
+	connection.reader = asyncio.ensure_future(connection._read_responses(websocket))
+	first = await connection._await_response({'route': 'live_values', 'data': {}})
+	try:
+		await connection._await_response({'route': 'get_boost_injection', 'data': {}})
+	except ConnectionError:
+		return first, connection, websocket
+	raise AssertionError('no connection error')
+
+def test_timeout_without_ids_closes_connection(config):
+	# a late response could only be matched by order and would be taken for the next request
+	first, connection, websocket = asyncio.run(_timeout_without_ids(config))
+	assert first == {'data': {'a': 1}}
+	assert connection.echoes_ids is False
+	assert not websocket.open
+	assert not connection.is_open()
+
+def _resume(config, error):
+	# authenticate with a stored session while the request raises the error given
+	config.update({
+		'general_ws_pipelining': True,
+		'eet_server_uri': 'ws://solmate:9124/',
+		'eet_serial_number': 'S1',
+		'eet_spare_serial_number': False,
+		'eet_device_id': 'esham'
+	})
+	session = {'configured_uri': 'ws://solmate:9124/', 'server_uri': 'ws://solmate:9124/', 'signature': 'sig'}
+	sol_websocket.sessions['session_S1'] = session
+	connection = sol_websocket.connect_to_solmate()
+
+	async def request(data, silent = False):
+		if data['route'] == 'authenticate':
+			raise error
+		raise Exception('login not expected')
+	connection._send_api_request = request
+
+	try:
+		asyncio.run(connection.authenticate())
+	except Exception as err:
+		return err.args, sol_websocket.sessions.get('session_S1')
+	finally:
+		sol_websocket.sessions.clear()
+
+def test_session_kept_on_timeout(config):
+	args, session = _resume(config, TimeoutError('No response'))
+	assert args == ('websocket', 'timeout')
+	assert session is not None
+
+def test_session_kept_on_connection_error(config):
+	args, session = _resume(config, ConnectionError('Connection closed unexpectedly.'))
+	assert args == ('websocket', 'conn_err')
+	assert session is not None
+
+def test_session_dropped_on_error_response(config):
+	# the full authentication follows, here it fails as the test does not expect it
+	args, session = _resume(config, Exception('Websocket: Response: invalid signature'))
+	assert args == ('websocket', 'auth')
+	assert session is None